@@ -0,0 +1,317 @@
+"""
+ASGI serving mode with bounded worker pools.
+
+The Flask app of server.py is run on worker threads, in one of two lanes:
+requests whose body is at most KVP_SHORT_MAX_BYTES (the editors' interactive
+requests, static files) go to the "short" lane, bigger ones (long documents,
+batches) to the "long" lane, so a long text can't hold up the short ones.
+Each lane runs at most `workers` requests at a time and queues at most
+`max_queue` more. When a lane is full the request is refused at once with
+429, and a request that waited longer than `max_wait` seconds in the queue
+gets 503; both carry a Retry-After header estimated from the recent service
+time of the lane.
+
+    $ pip install -r requirements-asgi.txt
+    $ uvicorn asgi:app --port 5000
+
+Lanes are configured with KVP_{SHORT,LONG}_{WORKERS,QUEUE,MAX_WAIT}. For more
+than one core, run several server processes.
+
+The WebSocket at /session serves live-editing sessions (see session.py):
+edits are converted on the short lane one at a time per connection, and an
+edit arriving while the previous one is converted stops that conversion.
+"""
+import asyncio
+import io
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SHORT_MAX_BYTES = int(os.environ.get('KVP_SHORT_MAX_BYTES', 4096))
+# Response messages a worker may produce ahead of the client, and how long
+# it waits for the client to read them
+RESPONSE_WINDOW = 16
+RESPONSE_TIMEOUT = 60
+
+class Lane:
+    """A thread pool running at most `workers` jobs, with at most `max_queue` more waiting."""
+
+    def __init__(self, name, workers, max_queue, max_wait):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=f'kvp-{name}')
+        self._lock = threading.Lock()
+        self._pending = 0
+        # Moving average of the time a job takes, for Retry-After
+        self._service_time = 0.05
+
+    @classmethod
+    def from_env(cls, name, workers, max_queue, max_wait):
+        prefix = f'KVP_{name.upper()}_'
+        return cls(
+            name,
+            int(os.environ.get(prefix + 'WORKERS', workers)),
+            int(os.environ.get(prefix + 'QUEUE', max_queue)),
+            float(os.environ.get(prefix + 'MAX_WAIT', max_wait)),
+        )
+
+    def stats(self):
+        with self._lock:
+            return { "pending" : self._pending, "workers" : self.workers, "max_queue" : self.max_queue, "service_time" : self._service_time }
+
+    def retry_after(self):
+        """Seconds until the jobs now pending should be done."""
+        with self._lock:
+            return max(1, math.ceil(self._pending * self._service_time / self.workers))
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                return False
+            self._pending += 1
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, func):
+        """
+        Run func() on the lane. Returns (True, result), or (False, status) when
+        the lane is full (429) or the job waited more than max_wait (503).
+        """
+        if not self._acquire():
+            return False, 429
+        queued_at = time.monotonic()
+        def job():
+            start = time.monotonic()
+            if start - queued_at > self.max_wait:
+                return False, 503
+            try:
+                return True, func()
+            finally:
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, job)
+        finally:
+            self._release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD' : scope['method'],
+        'SCRIPT_NAME' : scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO' : scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING' : scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME' : server[0],
+        'SERVER_PORT' : str(server[1]),
+        'SERVER_PROTOCOL' : 'HTTP/' + scope.get('http_version', '1.1'),
+        'CONTENT_LENGTH' : str(len(body)),
+        'wsgi.version' : (1, 0),
+        'wsgi.url_scheme' : scope.get('scheme', 'http'),
+        'wsgi.input' : io.BytesIO(body),
+        'wsgi.errors' : sys.stderr,
+        'wsgi.multithread' : True,
+        'wsgi.multiprocess' : False,
+        'wsgi.run_once' : False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+def _call_wsgi(wsgi_app, environ, send):
+    """
+    Run a WSGI app, passing the ASGI response messages to send() as the body
+    is produced, so streamed responses (NDJSON routes) reach the client line by line.
+    """
+    response = []
+    started = []
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+        return write
+    def start():
+        if not started:
+            status, headers = response
+            send({
+                'type' : 'http.response.start',
+                'status' : int(status.split(' ', 1)[0]),
+                'headers' : [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            })
+            started.append(True)
+    def write(chunk):
+        if chunk:
+            start()
+            send({ 'type' : 'http.response.body', 'body' : chunk, 'more_body' : True })
+    result = wsgi_app(environ, start_response)
+    try:
+        for chunk in result:
+            write(chunk)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    start()
+    send({ 'type' : 'http.response.body', 'body' : b'', 'more_body' : False })
+
+class ASGIApp:
+    """Serves a WSGI app over ASGI, each request running in the short or the long lane."""
+
+    def __init__(self, wsgi_app, short_lane, long_lane, short_max_bytes=SHORT_MAX_BYTES):
+        self.wsgi_app = wsgi_app
+        self.short_lane = short_lane
+        self.long_lane = long_lane
+        self.short_max_bytes = short_max_bytes
+
+    def lane_for(self, body):
+        return self.short_lane if len(body) <= self.short_max_bytes else self.long_lane
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            await self._websocket(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({ 'type' : 'lifespan.startup.complete' })
+            elif message['type'] == 'lifespan.shutdown':
+                self.short_lane.shutdown()
+                self.long_lane.shutdown()
+                await send({ 'type' : 'lifespan.shutdown.complete' })
+                return
+
+    async def _http(self, scope, receive, send):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        lane = self.lane_for(body)
+        environ = _wsgi_environ(scope, body)
+        # The worker thread hands the response messages over through a queue;
+        # the window keeps it from running ahead of a slow client
+        loop = asyncio.get_running_loop()
+        messages = asyncio.Queue()
+        window = threading.Semaphore(RESPONSE_WINDOW)
+        def send_threadsafe(message):
+            if not window.acquire(timeout=RESPONSE_TIMEOUT):
+                raise TimeoutError('client is not reading the response')
+            loop.call_soon_threadsafe(messages.put_nowait, message)
+        job = asyncio.ensure_future(lane.run(lambda: _call_wsgi(self.wsgi_app, environ, send_threadsafe)))
+        # Queued after every message of the job
+        job.add_done_callback(lambda _: messages.put_nowait(None))
+        while True:
+            message = await messages.get()
+            if message is None:
+                break
+            await send(message)
+            window.release()
+        ok, result = job.result()
+        if not ok:
+            status = result
+            message = f'too many {lane.name} requests' if status == 429 else f'{lane.name} requests are queued for too long'
+            content = json.dumps({ "error" : message + ', retry later' }).encode('utf-8')
+            headers = [(b'content-type', b'application/json'), (b'retry-after', str(lane.retry_after()).encode('latin-1'))]
+            await send({ 'type' : 'http.response.start', 'status' : status, 'headers' : headers })
+            await send({ 'type' : 'http.response.body', 'body' : content })
+
+    async def _websocket(self, scope, receive, send):
+        from session import Session
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        if scope['path'] != '/session':
+            await send({ 'type' : 'websocket.close', 'code' : 4404 })
+            return
+        await send({ 'type' : 'websocket.accept' })
+        session = Session()
+        # (seq, snapshot) of the latest edit not converted yet, and the
+        # cancel event of the conversion running
+        waiting = None
+        running = None
+        worker = None
+
+        async def reply(seq, fields):
+            await send({ 'type' : 'websocket.send', 'text' : json.dumps(dict(fields, seq=seq), ensure_ascii=False) })
+
+        async def convert_latest():
+            nonlocal waiting, running
+            while waiting is not None:
+                (seq, snapshot), waiting = waiting, None
+                running = threading.Event()
+                try:
+                    ok, fields = await self.short_lane.run(lambda snapshot=snapshot, cancel=running: session.run(snapshot, cancel))
+                except Exception as e:
+                    # Answer the edit rather than end the worker, later edits still get converted
+                    ok, fields = True, { "error" : f"{type(e).__name__}: {e}" }
+                finally:
+                    running = None
+                if not ok:
+                    fields = { "error" : f"too many {self.short_lane.name} requests, retry later" }
+                await reply(seq, fields)
+
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    return
+                try:
+                    edit = json.loads(message.get('text') or message.get('bytes') or '')
+                except ValueError:
+                    edit = None
+                if not isinstance(edit, dict) or not isinstance(edit.get('seq'), int):
+                    await reply(None, { "error" : 'expected a JSON object with a "seq" number' })
+                    continue
+                try:
+                    session.update(edit)
+                except ValueError as e:
+                    await reply(edit['seq'], { "error" : str(e) })
+                    continue
+                if waiting is not None:
+                    await reply(waiting[0], { "superseded" : True })
+                waiting = (edit['seq'], session.snapshot())
+                if running is not None:
+                    running.set()
+                elif worker is None or worker.done():
+                    worker = asyncio.ensure_future(convert_latest())
+        finally:
+            if running is not None:
+                running.set()
+            if worker is not None:
+                worker.cancel()
+
+def create_app(wsgi_app=None):
+    if wsgi_app is None:
+        from server import api as wsgi_app
+    return ASGIApp(
+        wsgi_app,
+        Lane.from_env('short', workers=4, max_queue=32, max_wait=5),
+        Lane.from_env('long', workers=2, max_queue=4, max_wait=60),
+    )
+
+app = create_app()
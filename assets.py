@@ -0,0 +1,173 @@
+"""
+Content-hashed, precompressed static files for the web UI.
+
+build() copies the files of web/ to CACHE_DIR/assets/ under names carrying a
+hash of their content (css/tailwind.min.css -> css/tailwind.min.3f2a9c1e07.css),
+with gzip and, when the brotli package is installed, brotli variants of the
+text and font files. A name never changes content, so these are served as
+immutable for a year; index.html is rewritten to refer to them and is
+revalidated on every visit. Files already built are kept, so each version of
+a file is hashed and compressed once, and the files of older builds are
+deleted, except those of the previous one (still referred to by the pages of
+servers not restarted yet during a deploy).
+
+Assets are built ahead of serving, not by the server:
+
+    $ python assets.py
+
+The server loads the manifest the build leaves in CACHE_DIR/assets/ (see
+load()) and serves web/ as is when there is none or web/ changed since.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+WEB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web')
+# Same directory as phonetics.CACHE_DIR
+ASSETS_DIR = os.path.join(os.environ.get('KVP_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')), 'assets')
+
+# Worth compressing (audio and images are compressed already)
+COMPRESSIBLE = {'.css', '.js', '.html', '.ttf', '.otf', '.svg', '.json', '.txt'}
+# Content-Encoding -> file suffix, in order of preference
+ENCODINGS = { 'br' : '.br', 'gzip' : '.gz' }
+MANIFEST = 'manifest.json'
+
+def compress(data, encoding, best=False):
+    """data compressed with encoding ('br' or 'gzip'), best for files built once, fast for responses."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else 5)
+    return gzip.compress(data, compresslevel=9 if best else 5, mtime=0)
+
+def available_encodings():
+    return [encoding for encoding in ENCODINGS if encoding != 'br' or brotli is not None]
+
+def hashed_name(name, content):
+    root, ext = os.path.splitext(name)
+    return f"{root}.{hashlib.sha1(content).hexdigest()[:10]}{ext}"
+
+def _write(path, content, replace=False):
+    if os.path.exists(path) and not replace:
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def _add(out_dir, name, content):
+    """Write content and its compressed variants under name's hashed name, returning it."""
+    hashed = hashed_name(name, content)
+    _write(os.path.join(out_dir, hashed), content)
+    if os.path.splitext(name)[1] in COMPRESSIBLE:
+        for encoding in available_encodings():
+            path = os.path.join(out_dir, hashed + ENCODINGS[encoding])
+            if not os.path.exists(path):
+                _write(path, compress(content, encoding, best=True))
+    return hashed
+
+def _rewrite_references(html, manifest):
+    """html with the quoted or url()'d paths of manifest replaced by their /assets/ URLs."""
+    if not manifest:
+        return html
+    names = sorted(manifest, key=len, reverse=True)
+    pattern = re.compile(r'(?<=["\'(])(?:' + '|'.join(re.escape(name) for name in names) + r')(?=["\')])')
+    return pattern.sub(lambda m: '/assets/' + manifest[m.group()], html)
+
+def _sources(web_dir):
+    """{ name : [size, mtime] } of the files of web_dir, names relative with / separators."""
+    sources = {}
+    for root, dirs, files in os.walk(web_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            stat = os.stat(path)
+            sources[os.path.relpath(path, web_dir).replace(os.sep, '/')] = [stat.st_size, stat.st_mtime_ns]
+    return sources
+
+def _read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def build(web_dir=WEB_DIR, out_dir=ASSETS_DIR):
+    """
+    Build the assets of web_dir into out_dir, write their manifest and delete
+    the files of the builds before the previous one. Returns the manifest
+    mapping each file of web_dir (relative, with / separators) to its hashed
+    name, index.html included.
+    """
+    sources = _sources(web_dir)
+    manifest = {}
+    for name in sources:
+        if name == 'index.html':
+            continue
+        with open(os.path.join(web_dir, name), 'rb') as f:
+            manifest[name] = _add(out_dir, name, f.read())
+    if 'index.html' in sources:
+        with open(os.path.join(web_dir, 'index.html'), encoding='utf-8') as f:
+            html = _rewrite_references(f.read(), manifest)
+        manifest['index.html'] = _add(out_dir, 'index.html', html.encode('utf-8'))
+    previous = _read_manifest(out_dir)
+    _write(os.path.join(out_dir, MANIFEST), json.dumps({ "files" : manifest, "sources" : sources }, indent=1).encode('utf-8'), replace=True)
+    _prune(out_dir, [manifest, previous["files"] if previous else {}])
+    return manifest
+
+def _prune(out_dir, manifests):
+    """Delete the files of out_dir that none of manifests refers to."""
+    keep = {MANIFEST}
+    for manifest in manifests:
+        for hashed in manifest.values():
+            keep.add(hashed)
+            keep.update(hashed + suffix for suffix in ENCODINGS.values())
+    for root, dirs, files in os.walk(out_dir, topdown=False):
+        for filename in files:
+            path = os.path.join(root, filename)
+            if os.path.relpath(path, out_dir).replace(os.sep, '/') not in keep:
+                os.remove(path)
+        if root != out_dir and not os.listdir(root):
+            os.rmdir(root)
+
+def load(web_dir=WEB_DIR, out_dir=ASSETS_DIR):
+    """
+    The manifest of the last build (see build), or {} when there is none or
+    the files of web_dir changed since.
+    """
+    saved = _read_manifest(out_dir)
+    if saved is None:
+        return {}
+    if saved["sources"] != _sources(web_dir):
+        print(f"{web_dir} changed since the assets were built, serving it as is (run python assets.py)")
+        return {}
+    return saved["files"]
+
+def variant(out_dir, name, accepted):
+    """
+    (file name, Content-Encoding) to send for the asset name, the compressed
+    variant for the first of accepted (encodings the client takes) that was
+    built, or (name, None).
+    """
+    if os.path.splitext(name)[1] in COMPRESSIBLE:
+        for encoding in accepted:
+            if encoding in ENCODINGS and os.path.exists(os.path.join(out_dir, name + ENCODINGS[encoding])):
+                return name + ENCODINGS[encoding], encoding
+    return name, None
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    out_dir = argv[0] if argv else ASSETS_DIR
+    manifest = build(WEB_DIR, out_dir)
+    print(f"Built {len(manifest)} assets in {out_dir} ({', '.join(available_encodings())})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Benchmarks for each stage of the conversion pipeline on fixed corpora.
+
+Corpora are the files in benchmarks/corpus/ (short: one verse, mantra:
+mantra-heavy lines, exceptions: lines full of segmentation exceptions) plus
+"long", 2,000 lines cycling through liturgy.txt, short.txt and mantra.txt.
+For every corpus and stage it reports the best time of `--repeat` runs,
+throughput in syllables per second and peak memory (tracemalloc, measured in
+a separate run). Results can be saved and later compared to spot regressions:
+
+    $ python benchmarks/bench_pipeline.py --save baseline.json
+    $ python benchmarks/bench_pipeline.py --compare baseline.json
+
+With --compare, the exit status is 1 if a stage got slower than the baseline
+by more than --threshold (default 20%).
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import phonetics
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'corpus')
+LONG_CORPUS_LINES = 2000
+
+_SYLLABLE = re.compile(r"[ཀ-ྼ]+")
+
+def _read_corpus(name):
+    with open(os.path.join(CORPUS_DIR, f"{name}.txt"), encoding="utf-8") as f:
+        return f.read()
+
+def load_corpora():
+    corpora = { name : _read_corpus(name) for name in ('short', 'mantra', 'exceptions') }
+    lines = itertools.cycle((_read_corpus('liturgy') + corpora['short'] + corpora['mantra']).splitlines())
+    corpora['long'] = "\n".join(itertools.islice(lines, LONG_CORPUS_LINES)) + "\n"
+    return corpora
+
+def _segmentbywords_botok_only(text):
+    """segmentbywords with the exceptions table emptied, so every line goes through botok."""
+    exceptions = phonetics._resource('_segmentation_exceptions')
+    phonetics._segmentation_exceptions = {}
+    try:
+        return phonetics.segmentbywords(text)
+    finally:
+        phonetics._segmentation_exceptions = exceptions
+
+def _find_all_sanskrit_matches(words):
+    for word in words:
+        phonetics._find_sanskrit_matches(word)
+
+def _add_phono(segmented):
+    # Measure conversions, not lookups in a cache warmed by the previous run
+    phonetics.PHON_CACHE.clear()
+    phonetics.add_phono(segmented, {})
+
+def stages(text):
+    """(stage name, callable) pairs for one corpus, the inputs each stage would get in the pipeline."""
+    segmented = phonetics.segmentbywords(text)
+    words = phonetics._normalize_tibetan(segmented).split()
+    return [
+        ('normalize', lambda: phonetics._normalize_tibetan(text)),
+        ('segmentbyone', lambda: phonetics.segmentbyone(text)),
+        ('segmentbytwo', lambda: phonetics.segmentbytwo(text)),
+        ('segmentbywords', lambda: phonetics.segmentbywords(text)),
+        ('segmentbywords_botok', lambda: _segmentbywords_botok_only(text)),
+        ('find_sanskrit_matches', lambda: _find_all_sanskrit_matches(words)),
+        ('add_phono', lambda: _add_phono(segmented)),
+    ]
+
+def _best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run(corpora, repeat=5, only=None):
+    """Returns { "corpus/stage": { "seconds", "syllables_per_sec", "peak_bytes" } }."""
+    phonetics.warm_up()
+    results = {}
+    for corpus, text in corpora.items():
+        syllables = len(_SYLLABLE.findall(text))
+        for stage, func in stages(text):
+            if only and stage not in only:
+                continue
+            seconds = _best_time(func, repeat)
+            results[f"{corpus}/{stage}"] = {
+                "seconds" : seconds,
+                "syllables_per_sec" : syllables / seconds if seconds else float('inf'),
+                "peak_bytes" : _peak_memory(func),
+            }
+    return results
+
+def compare(results, baseline, threshold):
+    """Print each result next to its baseline and return the names of stages slower by more than threshold."""
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        change = res["seconds"] / base["seconds"] - 1 if base["seconds"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:40} {base['seconds'] * 1000:10.2f} ms -> {res['seconds'] * 1000:10.2f} ms  {change:+7.1%}{flag}")
+    return regressions
+
+def print_results(results):
+    print(f"{'corpus/stage':40} {'time':>12} {'syl/s':>12} {'peak mem':>10}")
+    for name, res in results.items():
+        print(f"{name:40} {res['seconds'] * 1000:9.2f} ms {res['syllables_per_sec']:12.0f} {res['peak_bytes'] / 1024:7.0f} KB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the phonetics pipeline.")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per stage, the best one is kept")
+    parser.add_argument("--corpus", action="append", help="only run these corpora (short, long, mantra, exceptions)")
+    parser.add_argument("--stage", action="append", help="only run these stages")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare with results saved by --save")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    corpora = load_corpora()
+    if args.corpus:
+        corpora = { name : corpora[name] for name in args.corpus }
+    results = run(corpora, args.repeat, args.stage)
+    print_results(results)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Micro-benchmark for Sanskrit detection: the compiled index used by
+_find_sanskrit_matches against the previous loop over every pattern.
+
+    $ python benchmarks/bench_sanskrit.py [repeat]
+"""
+import csv
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import phonetics
+from phonetics import _SANSKRIT_PATTERNS, _find_sanskrit_matches
+
+MANTRAS = [
+    "ཨོཾ་ཨཱཿཧཱུྃ་བཛྲ་གུ་རུ་པདྨ་སིདྡྷི་ཧཱུྃ།",
+    "ཨོཾ་མ་ཎི་པདྨེ་ཧཱུྃ།",
+    "ཨོཾ་ཏཱ་རེ་ཏུཏྟཱ་རེ་ཏུ་རེ་སྭཱ་ཧཱ།",
+    "ཨོཾ་སྭ་བྷཱ་ཝ་ཤུདྡྷཿསརྦ་དྷརྨཿསྭ་བྷཱ་ཝ་ཤུདྡྷོ྅ཧཾ།",
+    "རྡོ་རྗེ་སློབ་དཔོན་ཨོཾ་ཨཱཿཧཱུྃ་སངས་རྒྱས་དཔལ",
+]
+
+def _legacy_find_sanskrit_matches(text):
+    """The per-pattern scan _find_sanskrit_matches replaced."""
+    matches = []
+    for compiled_pattern, _, transliteration, phonetics in _SANSKRIT_PATTERNS:
+        for match in compiled_pattern.finditer(text):
+            matches.append((match.start(), match.end(), transliteration, phonetics))
+    matches.sort(key=lambda x: (x[0], -(x[1] - x[0])))
+    filtered = []
+    last_end = 0
+    for start, end, trans, phon in matches:
+        if start >= last_end:
+            filtered.append((start, end, trans, phon))
+            last_end = end
+    return filtered
+
+def _load_words():
+    texts = list(MANTRAS)
+    csv_path = os.path.join(os.path.dirname(__file__), '..', 'tests', 'KVP_requirements.csv')
+    with open(csv_path, encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            texts.append(row['Tibetan'])
+    return [word for text in texts for word in phonetics.segmentbyone(text).split()]
+
+def main(repeat=5):
+    words = _load_words()
+    for word in words:
+        assert _find_sanskrit_matches(word) == _legacy_find_sanskrit_matches(word), word
+    legacy = min(timeit.repeat(lambda: [_legacy_find_sanskrit_matches(w) for w in words], number=1, repeat=repeat))
+    indexed = min(timeit.repeat(lambda: [_find_sanskrit_matches(w) for w in words], number=1, repeat=repeat))
+    print(f"{len(words)} words, {len(_SANSKRIT_PATTERNS)} patterns")
+    print(f"legacy loop:   {legacy * 1000:8.2f} ms")
+    print(f"indexed match: {indexed * 1000:8.2f} ms")
+    print(f"speedup:       {legacy / indexed:8.1f}x")
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
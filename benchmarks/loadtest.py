@@ -0,0 +1,237 @@
+"""
+Load test for the HTTP API of a running server.
+
+Simulated clients replay a fixed mix of requests to /segmentbywords,
+/segmentbytwo, /segmentbyone and /phoneticize, each sending its next request
+as soon as it gets the previous answer (plus --think milliseconds):
+
+    edit    an editor typing: a verse of short.txt or liturgy.txt sent again
+            each time a few more syllables are typed
+    paste   a long paste: 100 to 300 lines of liturgy.txt
+    mantra  a few lines of mantra.txt, with Sanskrit output
+
+The requests only depend on --seed, so runs against different serving modes
+(flask, asgi, prefork) or worker counts get the same traffic. For each route it
+reports latency percentiles, throughput, the share of errors (status 400
+and up, 429 and 503 counted apart as refused, or no answer) and the share of
+responses served from the server's response cache (its X-Cache header).
+
+Texts come back, as they do from real editors, so part of the traffic is
+answered from that cache. With --cold each request gets a line numbered
+differently added, so none is, and the latencies are those of conversions:
+
+    $ python prefork.py --workers 4 &
+    $ python benchmarks/loadtest.py --clients 16 --duration 30 --save prefork4.json
+    $ python benchmarks/loadtest.py --clients 16 --duration 30 --compare prefork4.json
+    $ python benchmarks/loadtest.py --clients 16 --duration 30 --cold
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'corpus')
+ROUTES = { 'words' : '/segmentbywords', 'two' : '/segmentbytwo', 'one' : '/segmentbyone', 'none' : '/phoneticize' }
+# Share of each kind of request, and of each route within it
+MIX = { 'edit' : 0.7, 'paste' : 0.1, 'mantra' : 0.2 }
+ROUTE_MIX = { 'words' : 0.6, 'two' : 0.15, 'one' : 0.15, 'none' : 0.1 }
+
+_SYLLABLE_END = re.compile(r"[་།༎༔ \n]+")
+_TIBETAN_DIGITS = str.maketrans("0123456789", "༠༡༢༣༤༥༦༧༨༩")
+
+def _read_corpus(name):
+    with open(os.path.join(CORPUS_DIR, f"{name}.txt"), encoding="utf-8") as f:
+        return [line for line in f.read().splitlines() if line.strip()]
+
+def _choose(rng, weights):
+    return rng.choices(list(weights), list(weights.values()))[0]
+
+def _edits(rng, verses):
+    """The texts an editor sends while typing a verse: a few more syllables each time."""
+    verse = rng.choice(verses)
+    ends = [m.end() for m in _SYLLABLE_END.finditer(verse)] or [len(verse)]
+    step = rng.randint(1, 3)
+    return [verse[:end] for end in ends[step - 1::step]]
+
+def _tibetan_number(n):
+    return str(n).translate(_TIBETAN_DIGITS)
+
+def client_requests(seed, client, cold=False):
+    """
+    Endless (kind, route, form fields) requests of a simulated client. With
+    cold, a line with a number of its own ends each text, so no two requests
+    of a run are the same.
+    """
+    rng = random.Random(f"{seed}/{client}")
+    verses = _read_corpus('short') + _read_corpus('liturgy')
+    liturgy = _read_corpus('liturgy')
+    mantras = _read_corpus('mantra')
+    for n in itertools.count():
+        kind = _choose(rng, MIX)
+        mode = _choose(rng, ROUTE_MIX)
+        if kind == 'edit':
+            requests = [{ "str" : text, "schemas" : "kvp" } for text in _edits(rng, verses)]
+        elif kind == 'paste':
+            start = rng.randrange(len(liturgy))
+            lines = list(itertools.islice(itertools.cycle(liturgy), start, start + rng.randint(100, 300)))
+            requests = [{ "str" : "\n".join(lines) }]
+        else:
+            requests = [{ "str" : "\n".join(rng.sample(mantras, rng.randint(1, 4))), "sanskrit_mode" : "iast" }]
+        for i, fields in enumerate(requests):
+            if cold:
+                fields["str"] += f"\n{_tibetan_number(client)}་{_tibetan_number(n)}་{_tibetan_number(i)}།"
+            yield kind, ROUTES[mode], fields
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+class _Client(threading.Thread):
+    def __init__(self, url, requests, stop_at, max_requests, think, records):
+        super().__init__(daemon=True)
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.requests = requests
+        self.stop_at = stop_at
+        self.max_requests = max_requests
+        self.think = think
+        self.records = records
+
+    def run(self):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+        for n, (kind, route, fields) in enumerate(self.requests):
+            if time.monotonic() >= self.stop_at or (self.max_requests and n >= self.max_requests):
+                break
+            body = urllib.parse.urlencode(fields).encode()
+            start = time.monotonic()
+            try:
+                conn.request('POST', route, body, { 'Content-Type' : 'application/x-www-form-urlencoded', 'Accept-Encoding' : 'gzip' })
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+                cache = response.getheader('X-Cache')
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                status = cache = None
+            self.records.append((route, kind, status, time.monotonic() - start, start, cache))
+            if self.think:
+                time.sleep(self.think)
+        conn.close()
+
+def run(url, clients=8, duration=10.0, requests_per_client=0, think=0.0, seed=0, cold=False):
+    """Run the load and return the summary (see summarize)."""
+    records = []
+    stop_at = time.monotonic() + duration if duration else float('inf')
+    threads = [_Client(url, client_requests(seed, i, cold), stop_at, requests_per_client, think, records) for i in range(clients)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(records, time.monotonic() - start)
+
+def _stats(records, elapsed):
+    latencies = sorted(record[3] for record in records if record[2] is not None and record[2] < 400)
+    refused = sum(1 for record in records if record[2] in (429, 503))
+    errors = sum(1 for record in records if record[2] is None or (record[2] >= 400 and record[2] not in (429, 503)))
+    # Among the answers saying whether they came from the response cache
+    cached = [record[5] == 'HIT' for record in records if record[5] is not None]
+    return {
+        "requests" : len(records),
+        "throughput" : len(records) / elapsed if elapsed else 0.0,
+        "p50_ms" : _ms(percentile(latencies, 50)),
+        "p95_ms" : _ms(percentile(latencies, 95)),
+        "p99_ms" : _ms(percentile(latencies, 99)),
+        "max_ms" : _ms(latencies[-1] if latencies else None),
+        "error_rate" : errors / len(records) if records else 0.0,
+        "refused_rate" : refused / len(records) if records else 0.0,
+        "cache_hit_rate" : sum(cached) / len(cached) if cached else None,
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+def summarize(records, elapsed):
+    """{ "elapsed", "routes": { route: stats }, "kinds": { kind: stats }, "total": stats }."""
+    by_route = {}
+    by_kind = {}
+    for record in records:
+        by_route.setdefault(record[0], []).append(record)
+        by_kind.setdefault(record[1], []).append(record)
+    return {
+        "elapsed" : elapsed,
+        "routes" : { route : _stats(route_records, elapsed) for route, route_records in sorted(by_route.items()) },
+        "kinds" : { kind : _stats(kind_records, elapsed) for kind, kind_records in sorted(by_kind.items()) },
+        "total" : _stats(records, elapsed),
+    }
+
+def _rows(summary):
+    yield from (("route " + name, stats) for name, stats in summary["routes"].items())
+    yield from (("kind " + name, stats) for name, stats in summary["kinds"].items())
+    yield "total", summary["total"]
+
+def _fmt(value):
+    return f"{value:9.1f}" if value is not None else f"{'-':>9}"
+
+def _rate(value):
+    return f"{value:7.1%}" if value is not None else f"{'-':>7}"
+
+def print_summary(summary):
+    print(f"{'':24} {'requests':>8} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'refused':>7} {'cached':>7}")
+    for name, stats in _rows(summary):
+        print(f"{name:24} {stats['requests']:8} {stats['throughput']:8.1f} {_fmt(stats['p50_ms'])} {_fmt(stats['p95_ms'])} "
+              f"{_fmt(stats['p99_ms'])} {_rate(stats['error_rate'])} {_rate(stats['refused_rate'])} {_rate(stats.get('cache_hit_rate'))}")
+
+def compare(summary, baseline):
+    """Print p95 latency and throughput next to those of a saved run."""
+    base_rows = dict(_rows(baseline))
+    print(f"{'':24} {'p95 ms':>21} {'req/s':>17} {'cached':>17}  (baseline: {baseline.get('label') or 'unlabelled'})")
+    for name, stats in _rows(summary):
+        base = base_rows.get(name)
+        if base is None:
+            continue
+        print(f"{name:24} {_fmt(base['p95_ms'])} -> {_fmt(stats['p95_ms'])} {base['throughput']:7.1f} -> {stats['throughput']:7.1f} "
+              f"{_rate(base.get('cache_hit_rate'))} -> {_rate(stats.get('cache_hit_rate'))}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a mix of conversion requests against a running server.")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("-c", "--clients", type=int, default=8, help="simulated clients sending requests at the same time")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="seconds to run (0 to only stop after --requests)")
+    parser.add_argument("-n", "--requests", type=int, default=0, help="requests per client (default: until --duration)")
+    parser.add_argument("--think", type=float, default=0.0, help="milliseconds a client waits between requests")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the request mix")
+    parser.add_argument("--cold", action="store_true", help="make every request different, so none is answered from the response cache")
+    parser.add_argument("--label", help="name of the setup tested (serving mode, workers...), saved with the results")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results saved by --save")
+    args = parser.parse_args(argv)
+    if not args.duration and not args.requests:
+        parser.error("give --duration or --requests")
+
+    summary = run(args.url, args.clients, args.duration, args.requests, args.think / 1000, args.seed, args.cold)
+    summary["label"] = args.label
+    summary["config"] = { "clients" : args.clients, "duration" : args.duration, "requests" : args.requests, "think" : args.think, "seed" : args.seed, "cold" : args.cold }
+    print_summary(summary)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        compare(summary, baseline)
+    return 1 if summary["total"]["requests"] == 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+class LRUCache:
+    """
+    Bounded, thread-safe least-recently-used cache with hit/miss/eviction counters.
+    A maxsize of 0 disables caching (every lookup is a miss, nothing is stored).
+    With a weight function (value -> size, e.g. len), the total weight of the
+    values is also kept under maxweight (0 for no bound on it).
+    """
+
+    def __init__(self, maxsize=10000, maxweight=0, weight=None):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self._weigh = weight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._data.get(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+            if self._weigh is not None:
+                weight = self._weigh(value)
+                if self.maxweight and weight > self.maxweight:
+                    return
+                previous = self._data.get(key, _MISSING)
+                if previous is not _MISSING:
+                    self.weight -= self._weigh(previous)
+                self.weight += weight
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._evict()
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, calling compute() and storing its result on a miss."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+            if self._weigh is not None:
+                stats["weight"] = self.weight
+                stats["maxweight"] = self.maxweight
+            return stats
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict(self):
+        while len(self._data) > max(self.maxsize, 0) or (self.maxweight and self.weight > self.maxweight):
+            _, value = self._data.popitem(last=False)
+            if self._weigh is not None:
+                self.weight -= self._weigh(value)
+            self.evictions += 1
+
+class PersistentCache:
+    """
+    String-to-string cache in an SQLite file, shared by processes and kept
+    across restarts. Entries belong to a data version and are only read by
+    caches of that version, so processes of different versions can share the
+    file during a deploy. The file keeps about max_rows entries (0 for no
+    bound): past that, the oldest ones are dropped, whatever their version,
+    which also clears out the entries of old versions in time
+    (drop_other_versions does it at once).
+    Each thread (and forked process) uses its own connection.
+    """
+
+    # Keys per query, under SQLite's limit on query parameters
+    BATCH = 500
+    # Share of max_rows dropped at once when the file is full
+    EVICT_FRACTION = 0.1
+
+    def __init__(self, path, version, max_rows=0):
+        self.path = path
+        self.version = version
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = self._db()
+        with db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries (version TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (version, key))")
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get_many(self, keys):
+        """Return { key: value } for the keys that are stored."""
+        keys = list(keys)
+        found = {}
+        db = self._db()
+        for i in range(0, len(keys), self.BATCH):
+            chunk = keys[i:i + self.BATCH]
+            rows = db.execute(
+                f"SELECT key, value FROM entries WHERE version = ? AND key IN ({','.join('?' * len(chunk))})",
+                [self.version, *chunk])
+            found.update(rows)
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Store the (key, value) pairs of items."""
+        items = [(self.version, key, value) for key, value in items]
+        if not items:
+            return
+        db = self._db()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO entries (version, key, value) VALUES (?, ?, ?)", items)
+            if self.max_rows:
+                self._evict(db)
+
+    def _evict(self, db):
+        """
+        Drop the oldest entries once there are more than max_rows. Rows are
+        numbered in insertion order (a replaced entry gets a new number), so
+        the span of the numbers bounds the count without scanning the table.
+        """
+        first, last = db.execute("SELECT MIN(rowid), MAX(rowid) FROM entries").fetchone()
+        if last - first + 1 <= self.max_rows:
+            return
+        keep = self.max_rows - int(self.max_rows * self.EVICT_FRACTION)
+        evicted = db.execute("DELETE FROM entries WHERE rowid <= ?", (last - keep,)).rowcount
+        with self._lock:
+            self.evictions += evicted
+
+    def drop_other_versions(self):
+        """Delete the entries of the other data versions, returning how many there were."""
+        db = self._db()
+        with db:
+            return db.execute("DELETE FROM entries WHERE version != ?", (self.version,)).rowcount
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def clear(self):
+        db = self._db()
+        with db:
+            db.execute("DELETE FROM entries")
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        size = self._db().execute("SELECT COUNT(*) FROM entries WHERE version = ?", (self.version,)).fetchone()[0]
+        with self._lock:
+            return {
+                "size": size,
+                "maxsize": self.max_rows or None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
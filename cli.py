@@ -0,0 +1,199 @@
+"""
+Batch conversion of Tibetan texts from the command line.
+
+Input is either a directory (every *.txt file below it is one document) or a
+JSONL stream ('-' for stdin), one {"id": ..., "str": ...} object per line;
+"mode", "sanskrit_mode", "anusvara_style" and "schemas" may be set per object.
+Documents are spread over a process pool and each result is written as soon
+as it is ready, as one JSONL object per document (to stdout or --output) or
+as <name>.segmented.txt / .kvp.txt / .ipa.txt files in --output-dir.
+Documents that can't be read or converted are reported (with their line
+number for JSONL) without stopping the others, and the exit status is 1.
+
+    $ python cli.py texts/ --output-dir out/ --mode words --sanskrit-mode iast
+    $ python cli.py verses.jsonl -o verses.out.jsonl --jobs 8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+
+def _init_worker():
+    # Build botok's WordTokenizer and the bophono converters once per worker
+    # process, not once per document
+    import phonetics
+    phonetics.warm_up()
+
+def _convert_document(doc):
+    from phonetics import convert
+    try:
+        res = convert(doc["str"], doc["mode"], sanskrit_mode=doc["sanskrit_mode"], anusvara_style=doc["anusvara_style"], schemas=doc["schemas"])
+    except Exception as e:
+        return { "id" : doc["id"], "error" : f"{type(e).__name__}: {e}" }
+    res["id"] = doc["id"]
+    return res
+
+def _convert_documents(docs):
+    """
+    Convert a chunk of documents, those sharing their options together so
+    their common words are phoneticized once. Results are in the order of docs.
+    """
+    from phonetics import convert_many
+    groups = {}
+    results = {}
+    for doc in docs:
+        if "error" in doc:
+            # Unreadable record (see _read_jsonl)
+            results[id(doc)] = doc
+            continue
+        try:
+            options = (doc["mode"], doc["sanskrit_mode"], doc["anusvara_style"], tuple(doc["schemas"]) if doc["schemas"] is not None else None)
+            groups.setdefault(options, []).append(doc)
+        except TypeError:
+            results[id(doc)] = { "id" : doc["id"], "error" : "invalid mode, sanskrit_mode, anusvara_style or schemas" }
+    for (mode, sanskrit_mode, anusvara_style, schemas), group in groups.items():
+        try:
+            converted = convert_many([doc["str"] for doc in group], mode, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+        except Exception:
+            # Convert the documents one by one to report the error on the right one
+            converted = [_convert_document(doc) for doc in group]
+        for doc, res in zip(group, converted):
+            res["id"] = doc["id"]
+            results[id(doc)] = res
+    return [results[id(doc)] for doc in docs]
+
+def _chunks(docs, size):
+    chunk = []
+    for doc in docs:
+        chunk.append(doc)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _read_directory(path):
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(".txt"):
+                file_path = os.path.join(root, name)
+                with open(file_path, encoding="utf-8") as f:
+                    yield { "id" : os.path.relpath(file_path, path)[:-len(".txt")], "str" : f.read() }
+
+def _read_jsonl(stream):
+    """
+    The documents of a JSONL stream. A line that isn't a JSON object with a
+    "str" gives an { "id", "error" } record instead, so the other documents
+    are still converted.
+    """
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            doc = json.loads(line)
+        except ValueError as e:
+            yield { "id" : line_number, "error" : f"line {line_number}: invalid JSON: {e}" }
+            continue
+        if not isinstance(doc, dict) or not isinstance(doc.get("str"), str):
+            yield { "id" : doc.get("id", line_number) if isinstance(doc, dict) else line_number, "error" : f'line {line_number}: "str" is required' }
+            continue
+        doc.setdefault("id", line_number)
+        yield doc
+
+def _read_jsonl_file(path):
+    with open(path, encoding="utf-8") as f:
+        yield from _read_jsonl(f)
+
+def _documents(args):
+    if os.path.isdir(args.input):
+        docs = _read_directory(args.input)
+    elif args.input == "-":
+        docs = _read_jsonl(sys.stdin)
+    else:
+        docs = _read_jsonl_file(args.input)
+    for doc in docs:
+        if "error" in doc:
+            yield doc
+            continue
+        yield {
+            "id" : doc["id"],
+            "str" : doc["str"],
+            "mode" : doc.get("mode", args.mode),
+            "sanskrit_mode" : doc.get("sanskrit_mode", args.sanskrit_mode),
+            "anusvara_style" : doc.get("anusvara_style", args.anusvara_style),
+            "schemas" : doc.get("schemas", args.schemas),
+        }
+
+def _write_files(output_dir, res):
+    """Write the results of a document under output_dir, raising ValueError when its id would put them elsewhere."""
+    root = os.path.abspath(output_dir)
+    base = os.path.abspath(os.path.join(root, str(res["id"])))
+    if os.path.commonpath([root, base]) != root or base == root:
+        raise ValueError(f"id {res['id']!r} is not a relative path inside the output directory")
+    os.makedirs(os.path.dirname(base) or ".", exist_ok=True)
+    for key in res:
+        if key != "id":
+            with open(f"{base}.{key}.txt", "w", encoding="utf-8") as f:
+                f.write(res[key])
+
+def run(args, out=None):
+    """Convert every document of args.input, writing results as they complete. Returns the number of errors."""
+    out = out or sys.stdout
+    chunks = _chunks(_documents(args), max(args.chunksize, 1))
+    if args.jobs == 1:
+        _init_worker()
+        pool = None
+        results = map(_convert_documents, chunks)
+    else:
+        pool = multiprocessing.Pool(args.jobs or None, initializer=_init_worker)
+        imap = pool.imap if args.ordered else pool.imap_unordered
+        results = imap(_convert_documents, chunks)
+    errors = 0
+    try:
+        for res in (res for chunk in results for res in chunk):
+            if "error" in res:
+                errors += 1
+                print(f"{res['id']}: {res['error']}", file=sys.stderr)
+            if args.output_dir and "error" not in res:
+                try:
+                    _write_files(args.output_dir, res)
+                except ValueError as e:
+                    errors += 1
+                    print(f"{res['id']}: {e}", file=sys.stderr)
+            else:
+                out.write(json.dumps(res, ensure_ascii=False) + "\n")
+                out.flush()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return errors
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Segment and phoneticize Tibetan texts in bulk.")
+    parser.add_argument("input", help="directory of .txt files, JSONL file, or - for JSONL on stdin")
+    parser.add_argument("-o", "--output", help="JSONL output file (default: stdout)")
+    parser.add_argument("--output-dir", help="write <id>.segmented.txt, .kvp.txt and .ipa.txt files here instead of JSONL")
+    parser.add_argument("--mode", default="words", choices=["words", "two", "one", "none"])
+    parser.add_argument("--sanskrit-mode", default=None, choices=["keep", "iast", "phonetics"])
+    parser.add_argument("--anusvara-style", default="ṃ", choices=["ṃ", "ṁ"])
+    parser.add_argument("--schemas", type=lambda value: value.split(","), default=None, help="comma-separated output schemas (default: kvp,ipa)")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="worker processes (default: one per core, 1 runs in-process)")
+    parser.add_argument("--chunksize", type=int, default=4, help="documents sent to a worker and converted together")
+    parser.add_argument("--ordered", action="store_true", help="write results in input order")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            errors = run(args, out)
+    else:
+        errors = run(args)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Line-level conversion for the live editor.
+
+Lines are converted independently and their results are kept in LINE_CACHE,
+keyed by the SHA-1 of the line (see line_hash) and the conversion options, so
+a client only needs to send the lines it has no result for. Each result holds
+the fields of the full conversion ("segmented" unless mode is 'none', and the
+requested schemas) for that single line, without the trailing newline.
+A line converted on its own can differ from the same line in a full
+conversion in two places: in 'one' and 'two' modes a final tsheg is added to
+every line, and (?) markers are never merged across line breaks.
+"""
+import hashlib
+import os
+
+from cache import LRUCache
+from phonetics import convert
+
+LINE_CACHE = LRUCache(int(os.environ.get('KVP_LINE_CACHE_SIZE', 50000)))
+
+def line_hash(line):
+    """SHA-1 hex digest of a line's UTF-8 encoding."""
+    return hashlib.sha1(line.encode('utf-8')).hexdigest()
+
+def _cache_key(mode, sanskrit_mode, anusvara_style, schemas, digest):
+    return (mode, sanskrit_mode, anusvara_style, tuple(schemas) if schemas is not None else None, digest)
+
+def convert_line(line, mode='words', sanskrit_mode=None, anusvara_style='ṃ', schemas=None, digest=None):
+    """Convert a single line, through LINE_CACHE."""
+    key = _cache_key(mode, sanskrit_mode, anusvara_style, schemas, digest or line_hash(line))
+    def compute():
+        res = convert(line, mode, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+        return { k : v[:-1] if v.endswith("\n") else v for k, v in res.items() }
+    return LINE_CACHE.get_or_compute(key, compute)
+
+def convert_lines(lines, mode='words', sanskrit_mode=None, anusvara_style='ṃ', schemas=None):
+    """
+    Convert the lines a client is missing.
+
+    Args:
+        lines: list of {"hash": ..., "str": ...} entries; "str" may be left out
+            when the server is expected to still have the line's result
+
+    Returns (results, missing): results maps each hash to its line result,
+    missing lists the hashes sent without text that are not in LINE_CACHE
+    (the client should send them again with their text).
+    """
+    results = {}
+    missing = []
+    for entry in lines:
+        text = entry.get("str")
+        if text is None:
+            digest = entry["hash"]
+            res = LINE_CACHE.get(_cache_key(mode, sanskrit_mode, anusvara_style, schemas, digest))
+            if res is None:
+                missing.append(digest)
+            else:
+                results[digest] = res
+            continue
+        # The hash is recomputed so a client can't store a result under another line's hash
+        digest = line_hash(text)
+        results[entry.get("hash", digest)] = convert_line(text, mode, sanskrit_mode, anusvara_style, schemas, digest=digest)
+    return results, missing
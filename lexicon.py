@@ -0,0 +1,218 @@
+"""
+Ahead-of-time phonetics lexicon.
+
+build() runs the bophono converters of phonetics.SCHEMAS over every word of
+botok's dictionary (with the affixed forms botok tokenizes as one word) and of
+segmentation_exceptions.csv, and writes the results to CACHE_DIR/lexicon.bin.
+phonetics looks fragments up there before PHON_CACHE and bophono, so only
+words missing from the file are analysed at request time.
+
+The file is a hash table read through mmap: opening it costs nothing, a
+lookup is a crc32 and a probe or two, and all the worker processes share the
+same pages. Each column holds the output of one converter, identified by its
+schema and options, so a converter set up differently never reads it. Results
+only depend on the bophono version, which the file records; rebuild it after
+upgrading bophono.
+
+    $ python lexicon.py                       # botok's default dialect pack
+    $ python lexicon.py --dialect-pack path/to/general -o lexicon.bin
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+from array import array
+
+MAGIC = b"KVPLEX01"
+# Same directory as phonetics.CACHE_DIR
+DEFAULT_PATH = os.path.join(os.environ.get('KVP_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')), 'lexicon.bin')
+
+def bophono_version():
+    from importlib import metadata
+    try:
+        return metadata.version('bophono')
+    except metadata.PackageNotFoundError:
+        return None
+
+def converter_column(phon):
+    """The column of a bophono converter: its schema and sorted options, as in phonetics._get_api."""
+    return (phon.schema, tuple(sorted(phon.options.items())))
+
+def _pad(data):
+    return data + b"\0" * (-len(data) % 4)
+
+def write(path, entries, columns, bophono=None):
+    """
+    Write a lexicon file. entries maps each word to its outputs, one per
+    column (see converter_column).
+    """
+    words = sorted(entries)
+    keys = [word.encode('utf-8') for word in words]
+    slots = array('I', [0]) * (1 << max(len(keys) * 2 - 1, 1).bit_length())
+    mask = len(slots) - 1
+    for n, key in enumerate(keys, 1):
+        i = zlib.crc32(key) & mask
+        while slots[i]:
+            i = (i + 1) & mask
+        slots[i] = n
+    sections = [slots.tobytes(), _blob(keys)]
+    for c in range(len(columns)):
+        sections.append(_blob([entries[word][c].encode('utf-8') for word in words]))
+    header = json.dumps({
+        "count" : len(keys),
+        "slots" : len(slots),
+        "columns" : [[schema, [list(option) for option in options]] for schema, options in columns],
+        "bophono" : bophono,
+        "byteorder" : sys.byteorder,
+    }, ensure_ascii=False).encode('utf-8')
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(_pad(struct.pack("<I", len(header)) + header))
+        for section in sections:
+            f.write(struct.pack("<I", len(section)))
+            f.write(_pad(section))
+    os.replace(tmp_path, path)
+
+def _blob(values):
+    """Offsets of values (len(values) + 1 of them, 4 bytes each) followed by the values."""
+    offsets = array('I', [0])
+    for value in values:
+        offsets.append(offsets[-1] + len(value))
+    return offsets.tobytes() + b"".join(values)
+
+class Lexicon:
+    """A lexicon file opened for lookups, raising ValueError when it isn't one."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        if view[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a lexicon file")
+        pos = len(MAGIC)
+        header_length, = struct.unpack_from("<I", view, pos)
+        self.header = json.loads(bytes(view[pos + 4:pos + 4 + header_length]).decode('utf-8'))
+        if self.header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was built on a {self.header['byteorder']}-endian machine")
+        pos += 4 + header_length + (-(4 + header_length) % 4)
+        sections = []
+        while pos < len(view):
+            length, = struct.unpack_from("<I", view, pos)
+            sections.append((pos + 4, pos + 4 + length))
+            pos += 4 + length + (-length % 4)
+        self.columns = { (schema, tuple(tuple(option) for option in options)) : c for c, (schema, options) in enumerate(self.header["columns"]) }
+        if len(sections) != 2 + len(self.columns):
+            raise ValueError(f"{path} is truncated")
+        count = self.header["count"]
+        start, end = sections[0]
+        self._slots = view[start:end].cast('I')
+        self._mask = len(self._slots) - 1
+        # (offsets, start of the data) of the keys, then of each column
+        self._blobs = [(view[start:start + 4 * (count + 1)].cast('I'), start + 4 * (count + 1)) for start, _ in sections[1:]]
+
+    def __len__(self):
+        return self.header["count"]
+
+    def get(self, column, word):
+        """The output of the converter column (see converter_column) for word, None when word isn't in the file."""
+        c = self.columns.get(column)
+        if c is None:
+            return None
+        key = word.encode('utf-8')
+        slots, mask, data = self._slots, self._mask, self._map
+        key_offsets, keys_start = self._blobs[0]
+        i = zlib.crc32(key) & mask
+        n = slots[i]
+        while n:
+            if data[keys_start + key_offsets[n - 1]:keys_start + key_offsets[n]] == key:
+                offsets, start = self._blobs[c + 1]
+                with self._lock:
+                    self.hits += 1
+                return data[start + offsets[n - 1]:start + offsets[n]].decode('utf-8')
+            i = (i + 1) & mask
+            n = slots[i]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def words(self):
+        offsets, start = self._blobs[0]
+        for n in range(len(self)):
+            yield self._map[start + offsets[n]:start + offsets[n + 1]].decode('utf-8')
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self),
+                "maxsize": None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": 0,
+            }
+
+def dictionary_words(dialect_pack=None):
+    """
+    The words of a botok dialect pack (botok's default one if None), as botok
+    tokenizes them: each entry and its affixed forms, ending with a tsheg.
+    """
+    from botok import BoSyl, Config, TokChunks, NAMCHE, TSEK
+    config = Config.from_path(dialect_pack) if dialect_pack else Config()
+    bosyl = BoSyl()
+    for category, paths in sorted(config.dictionary.items()):
+        if not category.startswith('words'):
+            continue
+        for path in sorted(paths):
+            with open(path, encoding='utf-8-sig') as f:
+                for line in f:
+                    form = line.split('#', 1)[0].split('\t', 1)[0].strip()
+                    syls = TokChunks(form).get_syls() if form else None
+                    if not syls:
+                        continue
+                    forms = [syls] + [syls[:-1] + [affixed] for affixed, _ in bosyl.get_all_affixed(syls[-1]) or []]
+                    for syls in forms:
+                        yield "".join(syl if syl.endswith(NAMCHE) else syl + TSEK for syl in syls)
+
+def build(path=DEFAULT_PATH, words=None):
+    """
+    Write the lexicon of words (botok's dictionary words by default) and of
+    the segmentation exceptions to path. Words are normalized like
+    add_phono does and split around Sanskrit patterns, so the entries are
+    the fragments bophono is actually asked for. Returns the number of entries.
+    """
+    import phonetics
+    if words is None:
+        words = dictionary_words()
+    converters = [phonetics._resource(resource) for resource in phonetics.SCHEMAS.values()]
+    exceptions = phonetics._resource('_segmentation_exceptions')
+    fragments = set()
+    for word in (*words, *(word for segmented in exceptions.values() for word in segmented.split())):
+        for tibetan, _ in phonetics._word_parts(phonetics._normalize_tibetan(word), None, 'ṃ'):
+            if tibetan is not None:
+                fragments.add(tibetan)
+    entries = { fragment : [phon.get_api(fragment) for phon in converters] for fragment in fragments }
+    write(path, entries, [converter_column(phon) for phon in converters], bophono_version())
+    return len(entries)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute the phonetics of botok's dictionary words.")
+    parser.add_argument("-o", "--output", default=DEFAULT_PATH, help=f"lexicon file to write (default: {DEFAULT_PATH})")
+    parser.add_argument("--dialect-pack", help="botok dialect pack directory (default: botok's general pack, downloaded if needed)")
+    args = parser.parse_args(argv)
+    count = build(args.output, dictionary_words(args.dialect_pack))
+    print(f"Wrote {count} words to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
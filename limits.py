@@ -0,0 +1,89 @@
+"""
+Limits on the work a single request can ask for.
+
+Input limits (checked before converting, 0 disables a limit):
+    KVP_MAX_CHARS       characters of the whole request (default 1000000)
+    KVP_MAX_LINE_CHARS  characters of a single line (default 20000), botok
+                        and the regexes work on whole lines
+    KVP_MAX_WORDS       words of the whole request, counted as the runs of
+                        text between spaces and tshegs (default 200000)
+
+Time budget: KVP_TIME_BUDGET seconds of CPU time (default 30, 0 to disable)
+for a conversion run inside budget(). The pipeline calls check() between
+lines and words, which raises BudgetExceeded once the budget is spent. A
+single regex or botok call can't be interrupted, the line limit bounds those.
+check() also raises Cancelled inside cancel_on(event) once event is set, to
+stop conversions whose result is no longer wanted.
+"""
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+MAX_CHARS = int(os.environ.get('KVP_MAX_CHARS', 1000000))
+MAX_LINE_CHARS = int(os.environ.get('KVP_MAX_LINE_CHARS', 20000))
+MAX_WORDS = int(os.environ.get('KVP_MAX_WORDS', 200000))
+TIME_BUDGET = float(os.environ.get('KVP_TIME_BUDGET', 30))
+
+_WORD = re.compile(r"[^\s་༌]+")
+_local = threading.local()
+
+class LimitExceeded(ValueError):
+    """The request asks for more work than allowed; status is the HTTP status to answer with."""
+    status = 413
+
+class BudgetExceeded(LimitExceeded):
+    """The conversion ran out of its time budget."""
+
+class Cancelled(Exception):
+    """The conversion was cancelled (see cancel_on)."""
+
+def check_texts(texts):
+    """Raise LimitExceeded when the texts of a request are over the input limits."""
+    chars = words = 0
+    for text in texts:
+        chars += len(text)
+        if MAX_CHARS and chars > MAX_CHARS:
+            raise LimitExceeded(f"input is longer than {MAX_CHARS} characters")
+        if MAX_LINE_CHARS and len(text) > MAX_LINE_CHARS and any(len(line) > MAX_LINE_CHARS for line in text.splitlines()):
+            raise LimitExceeded(f"input has a line longer than {MAX_LINE_CHARS} characters")
+        if MAX_WORDS:
+            words += len(_WORD.findall(text))
+            if words > MAX_WORDS:
+                raise LimitExceeded(f"input has more than {MAX_WORDS} words")
+
+@contextmanager
+def budget(seconds=None):
+    """
+    Give the conversions run by this thread inside the block `seconds` of
+    CPU time (TIME_BUDGET by default). Nested blocks keep the earliest deadline.
+    """
+    if seconds is None:
+        seconds = TIME_BUDGET
+    previous = getattr(_local, 'budget', None)
+    if seconds and (previous is None or time.thread_time() + seconds < previous[0]):
+        _local.budget = (time.thread_time() + seconds, seconds)
+    try:
+        yield
+    finally:
+        _local.budget = previous
+
+@contextmanager
+def cancel_on(event):
+    """Stop the conversions run by this thread inside the block once event (a threading.Event) is set."""
+    previous = getattr(_local, 'cancel', None)
+    _local.cancel = event
+    try:
+        yield
+    finally:
+        _local.cancel = previous
+
+def check():
+    """Raise BudgetExceeded when the budget of the current thread is spent, Cancelled when its conversion was cancelled."""
+    current = getattr(_local, 'budget', None)
+    if current is not None and time.thread_time() > current[0]:
+        raise BudgetExceeded(f"conversion took more than its {current[1]:g}s time budget, send a shorter text")
+    event = getattr(_local, 'cancel', None)
+    if event is not None and event.is_set():
+        raise Cancelled()
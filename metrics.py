@@ -0,0 +1,97 @@
+"""
+Optional timing of the conversion pipeline.
+
+Set KVP_METRICS=1 (or call enable()) to record how long each stage takes and
+how many lines, words and Sanskrit matches are processed. Instrumented code
+checks ENABLED before reading the clock, so nothing is measured or stored
+while it is off.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+ENABLED = os.environ.get('KVP_METRICS', '0') == '1'
+
+_lock = threading.Lock()
+# stage -> [total seconds, calls]
+_stages = {}
+# counter name -> count
+_counters = {}
+_local = threading.local()
+
+def enable(enabled=True):
+    global ENABLED
+    ENABLED = enabled
+
+def observe(stage, seconds):
+    """Record one call of a stage that took `seconds`."""
+    with _lock:
+        totals = _stages.get(stage)
+        if totals is None:
+            totals = _stages[stage] = [0.0, 0]
+        totals[0] += seconds
+        totals[1] += 1
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+def count(name, n=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+@contextmanager
+def collect():
+    """Also collect the stage durations recorded by this thread into the yielded dict (stage -> seconds)."""
+    previous = getattr(_local, 'timings', None)
+    timings = {}
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = previous
+
+def snapshot():
+    with _lock:
+        return {
+            "stages" : { stage : { "seconds" : totals[0], "calls" : totals[1] } for stage, totals in _stages.items() },
+            "counters" : dict(_counters),
+        }
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+def _labels(**labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels.items())
+
+def render_prometheus(caches=None):
+    """
+    Prometheus text exposition of the stage timings and counters.
+    caches maps a cache name to its LRUCache.stats().
+    """
+    data = snapshot()
+    out = [
+        "# HELP kvp_metrics_enabled Whether pipeline stages are being timed.",
+        "# TYPE kvp_metrics_enabled gauge",
+        f"kvp_metrics_enabled {int(ENABLED)}",
+        "# HELP kvp_stage_seconds_total Time spent in each conversion stage.",
+        "# TYPE kvp_stage_seconds_total counter",
+    ]
+    out += [f"kvp_stage_seconds_total{{{_labels(stage=stage)}}} {s['seconds']:.6f}" for stage, s in sorted(data["stages"].items())]
+    out += [
+        "# HELP kvp_stage_calls_total Number of times each conversion stage ran.",
+        "# TYPE kvp_stage_calls_total counter",
+    ]
+    out += [f"kvp_stage_calls_total{{{_labels(stage=stage)}}} {s['calls']}" for stage, s in sorted(data["stages"].items())]
+    out += [
+        "# HELP kvp_processed_total Lines, words and Sanskrit matches processed.",
+        "# TYPE kvp_processed_total counter",
+    ]
+    out += [f"kvp_processed_total{{{_labels(kind=name)}}} {n}" for name, n in sorted(data["counters"].items())]
+    if caches:
+        for stat, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("size", "gauge")):
+            name = f"kvp_cache_{stat}" + ("_total" if kind == "counter" else "")
+            out += [f"# TYPE {name} {kind}"]
+            out += [f"{name}{{{_labels(cache=cache)}}} {stats[stat]}" for cache, stats in sorted(caches.items())]
+    return "\n".join(out) + "\n"
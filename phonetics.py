@@ -1,45 +1,114 @@
 import re
 import unicodedata
+from array import array
 from botok import Text, WordTokenizer
 import bophono
 import csv
+import hashlib
 import os
+import pickle
+import threading
+import time
+from cache import LRUCache, PersistentCache
+import lexicon
+import limits
+import metrics
+from rules import Rule, RuleSet
 
 try:
+    import tibetan_sanskrit_transliteration_data
     from tibetan_sanskrit_transliteration_data import load_replacements
-    _SANSKRIT_REPLACEMENTS = load_replacements()
 except ImportError:
-    _SANSKRIT_REPLACEMENTS = []
+    tibetan_sanskrit_transliteration_data = None
+
+# Directory for generated files (precompiled tables), KVP_CACHE_DIR to override
+CACHE_DIR = os.environ.get('KVP_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache'))
+
+# Expensive module attributes (tokenizer, converters, Sanskrit and exception
+# tables) are built on first use by _resource, not at import.
+# Maps attribute name to (stage name reported in STARTUP_TIMES, builder).
+_RESOURCE_BUILDERS = {}
+_RESOURCE_LOCK = threading.RLock()
+
+# Seconds spent building each stage (not counting the stages it uses),
+# filled as resources are first used
+STARTUP_TIMES = {}
+# Time spent in nested builds, one entry per resource being built
+_BUILD_STACK = []
+
+def _resource(name):
+    """Return the module attribute `name`, building it first if needed."""
+    value = globals().get(name)
+    if value is None:
+        with _RESOURCE_LOCK:
+            value = globals().get(name)
+            if value is None:
+                stage, build = _RESOURCE_BUILDERS[name]
+                start = time.perf_counter()
+                _BUILD_STACK.append(0.0)
+                try:
+                    value = build()
+                finally:
+                    nested = _BUILD_STACK.pop()
+                elapsed = time.perf_counter() - start
+                STARTUP_TIMES[stage] = elapsed - nested
+                if _BUILD_STACK:
+                    _BUILD_STACK[-1] += elapsed
+                globals()[name] = value
+    return value
+
+def __getattr__(name):
+    if name in _RESOURCE_BUILDERS:
+        return _resource(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def warm_up():
+    """
+    Build everything conversions need, so the first request doesn't pay for it.
+    Servers should call this before accepting traffic.
+    Returns STARTUP_TIMES (seconds per stage).
+    """
+    for name in ('WT', 'PHON_KVP', 'PHON_API', '_SANSKRIT_INDEX', '_exceptions_matcher', '_LEXICON', '_PERSISTENT_CACHE'):
+        _resource(name)
+    return dict(STARTUP_TIMES)
+
+# Everything _normalize_tibetan changes after NFC, in one pass. Only spots that
+# change are matched, so already normalized text goes through a single search.
+_TIBETAN_NORMALIZATIONS = re.compile(
+    r"(?=[ༀཾཪ༌]|ིི|ུུ|་[་༌])"  # Quick check on where a match can start
+    r"(?:(?P<om>ༀ)(?P<om_vowel>ི+|ུ+|[ཱེོྀ])?"  # Om symbol, then its anusvara before a vowel
+    r"|ཾ(?P<vowel>ི+|ུ+|[ཱེོྀ])"  # Malformed: anusvara before vowel - swap them
+    r"|(?P<i>ི{2,})|(?P<u>ུ{2,})"  # Multiple i or u vowels
+    r"|(?P<ra>ཪླ)"
+    r"|(?P<tshek>[་༌]{2,}|༌))"  # Alternative and multiple consecutive tsheks
+)
+
+def _replace_tibetan_normalization(m):
+    kind = m.lastgroup
+    if kind == 'vowel':
+        # A run of i or u vowels counts as one
+        return m.group('vowel')[0] + 'ཾ'
+    if kind in ('om', 'om_vowel'):
+        if m.group('om_vowel'):
+            return 'ཨོ' + m.group('om_vowel')[0] + 'ཾ'
+        return 'ཨོཾ'
+    if kind == 'i':
+        return 'ི'
+    if kind == 'u':
+        return 'ུ'
+    if kind == 'ra':
+        return 'རླ'
+    return '་'
 
 def _normalize_tibetan(text):
     """
-    Normalize Tibetan text (ported from tibetan-normalizer JS).
+    Normalize Tibetan text (ported from tibetan-normalizer JS): NFC, Om symbol
+    spelled out, multiple i/u vowels and tsheks collapsed, ཪླ spelled རླ and
+    anusvara moved after the vowel.
     """
-    # Normalize Unicode
-    normalized = unicodedata.normalize('NFC', text)
-    
-    # Normalize combined letters
-    normalized = normalized.replace(' ', ' ')  # Non-breaking space
-    normalized = normalized.replace('ༀ', 'ཨོཾ')  # Om symbol
-    normalized = normalized.replace('ཀྵ', 'ཀྵ')
-    normalized = normalized.replace('བྷ', 'བྷ')
-    normalized = re.sub(r'ི+', 'ི', normalized)  # Multiple i vowels
-    normalized = re.sub(r'ུ+', 'ུ', normalized)  # Multiple u vowels
-    normalized = normalized.replace('ཱུ', 'ཱུ')
-    normalized = normalized.replace('ཱི', 'ཱི')
-    normalized = normalized.replace('ཱྀ', 'ཱྀ')
-    normalized = normalized.replace('དྷ', 'དྷ')
-    normalized = normalized.replace('གྷ', 'གྷ')
-    normalized = normalized.replace('ཪླ', 'རླ')
-    normalized = normalized.replace('ྡྷ', 'ྡྷ')
-    
-    # Normalize tsheks
-    # Malformed: anusvara before vowel - swap them
-    normalized = re.sub(r'(ཾ)([ཱེིོྀུ])', r'\2\1', normalized)
-    normalized = normalized.replace('༌', '་')  # Alternative tshek
-    normalized = re.sub(r'་+', '་', normalized)  # Multiple consecutive tsheks
-    
-    return normalized
+    if not unicodedata.is_normalized('NFC', text):
+        text = unicodedata.normalize('NFC', text)
+    return _TIBETAN_NORMALIZATIONS.sub(_replace_tibetan_normalization, text)
 
 def _normalize_iast_to_phonetics(text):
     """
@@ -74,11 +143,69 @@ options_fastidious = {
     'syllablesepchar': ''
 }
 
-WT = WordTokenizer()
+_RESOURCE_BUILDERS['WT'] = ('tokenizer', WordTokenizer)
 
 # Default converters with (?) markers for unknown syllables
-PHON_KVP = bophono.UnicodeToApi(schema="KVP", options = {'unknownSyllableMarker': True})
-PHON_API = bophono.UnicodeToApi(schema="MST", options = options_fastidious)
+_RESOURCE_BUILDERS['PHON_KVP'] = ('kvp_converter', lambda: bophono.UnicodeToApi(schema="KVP", options = {'unknownSyllableMarker': True}))
+_RESOURCE_BUILDERS['PHON_API'] = ('ipa_converter', lambda: bophono.UnicodeToApi(schema="MST", options = options_fastidious))
+
+# Memoizes converter output per (schema, options, fragment); size from KVP_PHON_CACHE_SIZE
+PHON_CACHE = LRUCache(int(os.environ.get('KVP_PHON_CACHE_SIZE', 100000)))
+
+def _get_api(phon, fragment):
+    """Phoneticize a Tibetan fragment with a bophono converter: from the lexicon, else through PHON_CACHE."""
+    column = lexicon.converter_column(phon)
+    lex = _resource('_LEXICON')
+    if lex:
+        phon_str = lex.get(column, fragment)
+        if phon_str is not None:
+            return phon_str
+    return PHON_CACHE.get_or_compute((*column, fragment), lambda: _timed_get_api(phon, fragment))
+
+def _timed_get_api(phon, fragment):
+    if not metrics.ENABLED:
+        return phon.get_api(fragment)
+    start = time.perf_counter()
+    phon_str = phon.get_api(fragment)
+    metrics.observe('bophono', time.perf_counter() - start)
+    return phon_str
+
+def _open_lexicon():
+    """
+    The lexicon.Lexicon set with KVP_LEXICON (a file path, CACHE_DIR/lexicon.bin
+    by default, 0 to disable), False when there is none or it was built with
+    another bophono version.
+    """
+    path = os.environ.get('KVP_LEXICON', '')
+    if path == '0':
+        return False
+    path = path or os.path.join(CACHE_DIR, 'lexicon.bin')
+    if not os.path.exists(path):
+        return False
+    try:
+        lex = lexicon.Lexicon(path)
+    except (OSError, ValueError) as e:
+        print(f"Could not open lexicon {path}: {e}")
+        return False
+    if lex.header["bophono"] != lexicon.bophono_version():
+        print(f"Lexicon {path} was built with bophono {lex.header['bophono']}, rebuild it with python lexicon.py")
+        return False
+    return lex
+
+_RESOURCE_BUILDERS['_LEXICON'] = ('lexicon', _open_lexicon)
+
+def lexicon_stats():
+    """Return the lexicon's size and hit/miss counters, None when there is no lexicon."""
+    lex = _resource('_LEXICON')
+    return lex.stats() if lex else None
+
+def set_phon_cache_size(maxsize):
+    """Change the number of entries PHON_CACHE keeps (0 disables it)."""
+    PHON_CACHE.resize(maxsize)
+
+def phon_cache_stats():
+    """Return PHON_CACHE size and hit/miss/eviction counters."""
+    return PHON_CACHE.stats()
 
 # Sanskrit-specific characters that don't appear in regular Tibetan words:
 # - ཱ (0F71) vowel length mark (used in Sanskrit for long vowels like ā, ī, ū)
@@ -108,13 +235,90 @@ def _is_sanskrit_specific(tibetan_pattern):
     """
     return bool(_SANSKRIT_ONLY_CHARS.search(tibetan_pattern))
 
+_REPEAT_BOUNDS = re.compile(r'\{(\d*)(,?)(\d*)\}')
+_GROUP_PREFIX = re.compile(r'\?(P<\w+>|P=\w+|<?[=!]|[:>]|[aiLmsux-]*:?)')
+
+def _quantifier_end(source, i):
+    """
+    End of the quantifier starting at source[i] (i itself if there is none),
+    and whether it repeats without a small bound (*, + or {n,}).
+    """
+    if i < len(source) and source[i] in '*+?':
+        end, unbounded = i + 1, source[i] != '?'
+    else:
+        m = _REPEAT_BOUNDS.match(source, i)
+        if m is None:
+            return i, False
+        end, unbounded = m.end(), bool(m.group(2)) and not m.group(3)
+    # Lazy or possessive forms
+    if end < len(source) and source[end] in '?+':
+        end += 1
+    return end, unbounded
+
+def _backtracking_groups(source):
+    """
+    (start, end) of the groups of regex source that are repeated without
+    bound while they can themselves match in several ways (a quantifier or
+    an alternation of overlapping branches inside), like (a+)+ or (a|ab)*:
+    on a failed match the engine tries every way of splitting the text
+    between the repetitions. Only the outermost such groups are returned.
+    """
+    spans = []
+    # For each open group: [start, start of its content, contains a quantifier or nested group, contains an alternation]
+    stack = [[0, 0, False, False]]
+    i = 0
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+        elif char == '[':
+            # Skip the class, a ] right after [ or [^ is part of it
+            i += 2 if source.startswith('[^', i) else 1
+            i += source[i] == ']'
+            while i < len(source) and source[i] != ']':
+                i += 2 if source[i] == '\\' else 1
+            i += 1
+        elif char == '(':
+            start = i
+            i += 1
+            if source.startswith('?', i):
+                # (?:, (?P<name>, lookarounds...: skip the group's prefix
+                i = _GROUP_PREFIX.match(source, i).end()
+            stack.append([start, i, False, False])
+        elif char == ')' and len(stack) > 1:
+            start, content_start, quantified, alternation = stack.pop()
+            variable = quantified or (alternation and not _distinct_literals(source[content_start:i].split('|')))
+            end, unbounded = _quantifier_end(source, i + 1)
+            if unbounded and variable:
+                spans = [span for span in spans if span[0] < start] + [(start, end)]
+            stack[-1][2] = stack[-1][2] or variable or end > i + 1
+            i = end
+        elif char == '|':
+            stack[-1][3] = True
+            i += 1
+        else:
+            end, _ = _quantifier_end(source, i)
+            if end > i:
+                stack[-1][2] = True
+                i = end
+            else:
+                i += 1
+    return spans
+
+def _distinct_literals(branches):
+    """Whether the branches of an alternation are plain strings starting with different characters: only one can match."""
+    if any(not branch or _REGEX_METACHARS.intersection(branch) for branch in branches):
+        return False
+    return len({branch[0] for branch in branches}) == len(branches)
+
 # Build compiled regex patterns for Sanskrit detection (sorted by length, longest first)
 def _build_sanskrit_patterns():
     """Build sorted list of (compiled_regex, transliteration, phonetics) tuples."""
-    if not _SANSKRIT_REPLACEMENTS:
+    replacements = _resource('_SANSKRIT_REPLACEMENTS')
+    if not replacements:
         return []
     patterns = []
-    for entry in _SANSKRIT_REPLACEMENTS:
+    for entry in replacements:
         tibetan = entry.get('tibetan', '')
         transliteration = entry.get('transliteration', '')
         # If phonetics field is empty, normalize IAST to get phonetics
@@ -125,37 +329,111 @@ def _build_sanskrit_patterns():
             try:
                 # Compile the pattern (some entries use regex)
                 compiled = re.compile(tibetan)
-                patterns.append((compiled, tibetan, transliteration, phonetics))
             except re.error:
                 # If it's not a valid regex, escape it
                 compiled = re.compile(re.escape(tibetan))
-                patterns.append((compiled, tibetan, transliteration, phonetics))
+            else:
+                if _backtracking_groups(tibetan):
+                    # Rewriting the pattern could change what it matches, the line limit bounds the damage
+                    print(f"Sanskrit pattern {tibetan} can backtrack catastrophically on long lines, consider rewriting it")
+            patterns.append((compiled, tibetan, transliteration, phonetics))
     # Sort by pattern length (longest first) to match longer patterns before shorter ones
     patterns.sort(key=lambda x: len(x[1]), reverse=True)
     return patterns
 
-_SANSKRIT_PATTERNS = _build_sanskrit_patterns()
+def _load_sanskrit_replacements():
+    if tibetan_sanskrit_transliteration_data is None:
+        return []
+    return load_replacements()
+
+_RESOURCE_BUILDERS['_SANSKRIT_REPLACEMENTS'] = ('sanskrit_replacements', _load_sanskrit_replacements)
+_RESOURCE_BUILDERS['_SANSKRIT_PATTERNS'] = ('sanskrit_patterns', _build_sanskrit_patterns)
+
+_REGEX_METACHARS = frozenset('.^$*+?{}[]\\|()')
+
+def _build_sanskrit_index(patterns):
+    """
+    Split the Sanskrit patterns into a character trie for the literal entries
+    and a residual list for the entries that really are regexes.
+    Each entry keeps its position in `patterns` so ties are broken the same
+    way as the sorted pattern list.
+    Returns plain data (trie, residual) that _compile_sanskrit_index turns
+    into the index _find_sanskrit_matches uses; residual entries are
+    (order, regex source, transliteration, phonetics).
+    """
+    trie = {}
+    residual = []
+    for order, (compiled, tibetan, transliteration, phonetics) in enumerate(patterns):
+        if compiled.pattern == re.escape(tibetan) or _REGEX_METACHARS.isdisjoint(tibetan):
+            node = trie
+            for char in tibetan:
+                node = node.setdefault(char, {})
+            # The empty key marks the end of a literal (trie keys are single chars)
+            node.setdefault('', []).append((order, transliteration, phonetics))
+        else:
+            residual.append((order, compiled.pattern, transliteration, phonetics))
+    return trie, residual
+
+def _compile_sanskrit_index(index_data):
+    """
+    Compile the residual regexes of _build_sanskrit_index's output.
+    Returns (trie, residual, gate) where gate is a single regex matching
+    anywhere any residual pattern could match (None if it can't be built).
+    """
+    trie, residual_sources = index_data
+    residual = [(order, re.compile(source), transliteration, phonetics)
+                for order, source, transliteration, phonetics in residual_sources]
+    gate = None
+    if residual and not any(re.search(r'\\\d|\(\?P=', p.pattern) for _, p, _, _ in residual):
+        try:
+            gate = re.compile('|'.join(f'(?:{p.pattern})' for _, p, _, _ in residual))
+        except re.error:
+            gate = None
+    return trie, residual, gate
+
+_RESOURCE_BUILDERS['_SANSKRIT_INDEX'] = ('sanskrit_index', lambda: _compile_sanskrit_index(_resource('_PRECOMPILED')['sanskrit_index']))
 
 def _find_sanskrit_matches(text):
     """
     Find all Sanskrit pattern matches in text.
     Returns list of (start, end, transliteration, phonetics) tuples, sorted by position.
+    Longest match wins, then the earliest pattern in _SANSKRIT_PATTERNS; matches don't overlap.
     """
-    if not _SANSKRIT_PATTERNS:
+    trie, residual, gate = _resource('_SANSKRIT_INDEX')
+    if not trie and not residual:
         return []
     
     matches = []
-    for compiled_pattern, _, transliteration, phonetics in _SANSKRIT_PATTERNS:
-        for match in compiled_pattern.finditer(text):
-            matches.append((match.start(), match.end(), transliteration, phonetics))
+    # Literal entries: one walk of the trie from each position.
+    # A literal only matches again after its previous match ends, like finditer.
+    literal_ends = {}
+    length = len(text)
+    for start in range(length):
+        node = trie.get(text[start])
+        end = start + 1
+        while node is not None:
+            for order, transliteration, phonetics in node.get('', ()):
+                if start >= literal_ends.get(order, 0):
+                    matches.append((start, end, order, transliteration, phonetics))
+                    literal_ends[order] = end
+            if end == length:
+                break
+            node = node.get(text[end])
+            end += 1
+    
+    # Regex entries, skipped entirely when none of them can match
+    if residual and (gate is None or gate.search(text)):
+        for order, compiled_pattern, transliteration, phonetics in residual:
+            for match in compiled_pattern.finditer(text):
+                matches.append((match.start(), match.end(), order, transliteration, phonetics))
     
     # Sort by start position, then by length (longer matches first for same start)
-    matches.sort(key=lambda x: (x[0], -(x[1] - x[0])))
+    matches.sort(key=lambda x: (x[0], -(x[1] - x[0]), x[2]))
     
     # Remove overlapping matches (keep the first/longest one)
     filtered = []
     last_end = 0
-    for start, end, trans, phon in matches:
+    for start, end, _, trans, phon in matches:
         if start >= last_end:
             filtered.append((start, end, trans, phon))
             last_end = end
@@ -167,9 +445,6 @@ def _process_word_sanskrit(word, sanskrit_mode, anusvara_style='ṃ'):
     Process a single word, extracting Sanskrit parts and Tibetan parts.
     Returns list of (text, is_sanskrit) tuples.
     """
-    if not _SANSKRIT_PATTERNS:
-        return [(word, False)]
-    
     matches = _find_sanskrit_matches(word)
     if not matches:
         return [(word, False)]
@@ -184,17 +459,7 @@ def _process_word_sanskrit(word, sanskrit_mode, anusvara_style='ṃ'):
             if tibetan_part:
                 result.append((tibetan_part, False))
         
-        # Determine Sanskrit output based on mode
-        if sanskrit_mode == 'iast':
-            output = transliteration
-            if anusvara_style == 'ṁ':
-                output = output.replace('ṃ', 'ṁ')
-        elif sanskrit_mode == 'phonetics':
-            output = phonetics
-        else:
-            output = '(?)'
-        
-        result.append((output, True))
+        result.append((_sanskrit_output(transliteration, phonetics, sanskrit_mode, anusvara_style), True))
         last_end = end
     
     # Add any remaining Tibetan text after the last match
@@ -205,93 +470,257 @@ def _process_word_sanskrit(word, sanskrit_mode, anusvara_style='ṃ'):
     
     return result
 
+class Segmentation:
+    """
+    What the segmenters produce: text with a space to insert at each of cuts
+    (ascending offsets into text). Cuts never fall inside a word, so the words
+    of a line are the whitespace-separated runs of the pieces between cuts;
+    add_phono reads them from there and the segmented string is only built by str().
+    """
+    __slots__ = ('text', 'cuts')
+
+    def __init__(self, text, cuts=None):
+        self.text = text
+        self.cuts = cuts if cuts is not None else array('l')
+
+    def pieces(self):
+        text = self.text
+        start = 0
+        for cut in self.cuts:
+            yield text[start:cut]
+            start = cut
+        yield text[start:]
+
+    def line_words(self):
+        """The words of each line of str(self), a list per line."""
+        lines = [[]]
+        for piece in self.pieces():
+            if "\n" not in piece:
+                lines[-1].extend(piece.split())
+                continue
+            parts = piece.split("\n")
+            lines[-1].extend(parts[0].split())
+            for part in parts[1:]:
+                lines.append(part.split())
+        return lines
+
+    def __str__(self):
+        return ' '.join(self.pieces()) if self.cuts else self.text
+
+# A syllable with what follows it up to the next one, and two of them
+_SYLLABLE = re.compile("[\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+")
+_SYLLABLE_GROUP = re.compile("[\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+[^\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]*")
+_SYLLABLE_PAIR = re.compile("[\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+[^\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+[\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+[^\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]*")
+
 def segmentbyone(in_str):
-    lines = _enforce_tshegs_at_the_end(in_str).split("\n")
-    res = ""
-    for l in lines:
-        l = re.sub(r"([\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+[^\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]*)", r"\1 ", l)
-        res += l+"\n"
-    return res
+    return str(_segmentation_by_one(in_str))
+
+def _segmentation_by_one(in_str):
+    return _segmentation_by_lines(in_str, _cut_line_by_one, 'segmentbyone')
+
+def _segment_line_by_one(l):
+    l, cuts = _cut_line_by_one(l)
+    return str(Segmentation(l, cuts))
+
+def _cut_line_by_one(l):
+    """(line, cuts): a space after each syllable and what follows it."""
+    limits.check()
+    return l, [m.end() for m in _SYLLABLE_GROUP.finditer(l)]
 
 def segmentbytwo(in_str):
+    return str(_segmentation_by_two(in_str))
+
+def _segmentation_by_two(in_str):
+    return _segmentation_by_lines(in_str, _cut_line_by_two, 'segmentbytwo')
+
+def _segment_line_by_two(l):
+    l, cuts = _cut_line_by_two(l)
+    return str(Segmentation(l, cuts))
+
+def _cut_line_by_two(l):
+    """(line, cuts): a space after every second syllable, a last odd one staying with the pair before it."""
+    limits.check()
+    cuts = [m.end() for m in _SYLLABLE_PAIR.finditer(l)]
+    if len(_SYLLABLE.findall(l)) % 2 == 1:
+        if cuts:
+            # No space between the last pair and the odd syllable after it
+            cuts.pop()
+        else:
+            # A single syllable loses the space before it
+            last = _SYLLABLE.search(l).start()
+            if last > 0 and l[last - 1] == ' ':
+                l = l[:last - 1] + l[last:]
+    return l, cuts
+
+def _segmentation_by_lines(in_str, cut_line, stage):
+    """Segmentation of the lines of in_str (each followed by "\n"), cut_line giving each line's (line, cuts)."""
+    timed = metrics.ENABLED
+    if timed:
+        start = time.perf_counter()
     lines = _enforce_tshegs_at_the_end(in_str).split("\n")
-    res = ""
-    for l in lines:
-        countsyls = len(re.findall("[\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+", l))
-        l = re.sub(r"([\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+[^\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+[\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+[^\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]*)", r"\1 ", l)
-        if countsyls % 2 == 1:
-            l = re.sub(r" ([\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]+[^\u0F35\u0F37ཀ-\u0f7e\u0F80-\u0FBC]*)$", r"\1", l)
-        res += l+"\n"
-    return res
+    cuts = array('l')
+    offset = 0
+    for i, l in enumerate(lines):
+        l, line_cuts = cut_line(l)
+        lines[i] = l
+        cuts.extend(offset + cut for cut in line_cuts)
+        offset += len(l) + 1
+    segmentation = Segmentation("\n".join(lines) + "\n", cuts)
+    if timed:
+        metrics.observe(stage, time.perf_counter() - start)
+        metrics.count('lines', len(lines))
+    return segmentation
+
+# Tokenize each line with botok once and cut the tokens around the exceptions,
+# instead of running botok on every fragment between exceptions
+SINGLE_PASS_BOTOK = os.environ.get('KVP_SINGLE_PASS_BOTOK', '1') != '0'
 
 def segmentbywords(in_str):
     # Preserve newlines by processing line by line
-    lines = in_str.splitlines()
-    segmented_lines = []
-    for line in lines:
-        line = _enforce_tshegs_at_the_end(line)
-        # Build a regex that matches any exception
-        exception_patterns = sorted(_segmentation_exceptions.keys(), key=len, reverse=True)
-        if not exception_patterns:
-            # No exceptions, just use Botok as before
-            segmented_lines.append(_segmentbywords_botok(line))
-            continue
-        pattern = "(" + "|".join(map(re.escape, exception_patterns)) + ")"
-        # Split input into exceptions and non-exceptions
-        parts = re.split(pattern, line)
-        result = []
-        i = 0
-        while i < len(parts):
-            part = parts[i]
-            if part in _segmentation_exceptions:
-                segmented_exception = _segmentation_exceptions[part]
-                
-                # Always add a space before the exception
-                next_part = parts[i+1] if i+1 < len(parts) else ''
-                next_part_stripped = next_part.lstrip()
-                # Particles: འི, ར, ས
-                if next_part_stripped.startswith(('འི', 'ར', 'ས')):
-                    # No space after exception
+    return "\n".join(_segment_lines_by_words(in_str.splitlines()))
+
+def _segmentation_by_words(in_str):
+    # The rules and exceptions rewrite the text, it comes out already spaced
+    return Segmentation(segmentbywords(in_str))
+
+def _segment_lines_by_words(lines):
+    exceptions = _resource('_segmentation_exceptions')
+    timed = metrics.ENABLED
+    if timed:
+        metrics.count('lines', len(lines))
+    # Segmented lines stored by a previous run, unless the exceptions were
+    # replaced at runtime (they are not part of the cache's data version then)
+    persistent = _resource('_PERSISTENT_CACHE')
+    if persistent and exceptions is _resource('_PRECOMPILED')['segmentation_exceptions']:
+        keys = { line : _persistent_key('words', line) for line in lines }
+        stored = persistent.get_many(set(keys.values()))
+        computed = {}
+        segmented_lines = []
+        for line in lines:
+            key = keys[line]
+            if key not in stored:
+                stored[key] = computed[key] = _segment_line_by_words(line, exceptions, timed)
+            segmented_lines.append(stored[key])
+        persistent.put_many(computed.items())
+    else:
+        segmented_lines = [_segment_line_by_words(line, exceptions, timed) for line in lines]
+    return segmented_lines
+
+def _segment_line_by_words(line, exceptions, timed):
+    limits.check()
+    line = _enforce_tshegs_at_the_end(line)
+    if not exceptions:
+        # No exceptions, just use Botok as before
+        return _segmentbywords_botok(line)
+    # Split input into exceptions and non-exceptions
+    if timed:
+        start = time.perf_counter()
+    parts = _split_on_exceptions(line)
+    if timed:
+        metrics.observe('exceptions', time.perf_counter() - start)
+    line_tokens = None
+    if SINGLE_PASS_BOTOK and sum(1 for part in parts[::2] if part.strip()) > 1:
+        line_tokens = _botok_spans(line)
+    result = []
+    i = 0
+    offset = 0
+    while i < len(parts):
+        part = parts[i]
+        if part in exceptions:
+            segmented_exception = exceptions[part]
+            
+            # Always add a space before the exception
+            next_part = parts[i+1] if i+1 < len(parts) else ''
+            next_part_stripped = next_part.lstrip()
+            # Particles: འི, ར, ས
+            if next_part_stripped.startswith(('འི', 'ར', 'ས')):
+                # No space after exception
+                result.append(f" {segmented_exception}")
+            else:
+                combined = f"{segmented_exception}{next_part_stripped}"
+                if timed:
+                    start = time.perf_counter()
+                would_change = _POSTSEGMENT_RULES.would_change(combined)
+                if timed:
+                    metrics.observe('postsegment', time.perf_counter() - start)
+                # If there would have been a postsegment,
+                # Then don't add a space after the exception
+                # Otherwise add one
+                if would_change:
                     result.append(f" {segmented_exception}")
                 else:
-                    combined = f"{segmented_exception}{next_part_stripped}"
-                    processed_combined = _postsegment(combined)
-                    # If there would have been a postsegment,
-                    # Then don't add a space after the exception
-                    # Otherwise add one
-                    if processed_combined != combined:
-                        result.append(f" {segmented_exception}")
-                    else:
-                        result.append(f" {segmented_exception} ")
-            elif part.strip():
+                    result.append(f" {segmented_exception} ")
+        elif part.strip():
+            spans = None
+            if line_tokens is not None:
+                spans = _spans_within(line, line_tokens, offset, offset + len(part))
+            if spans is None:
                 result.append(_segmentbywords_botok(part))
-            i += 1
-        # Collapse multiple spaces to one, and strip leading/trailing space for each line
-        segmented_lines.append(" ".join("".join(result).split()))
-    return "\n".join(segmented_lines)
+            else:
+                result.append(_join_tokens(line, spans))
+        offset += len(part)
+        i += 1
+    # Collapse multiple spaces to one, and strip leading/trailing space for each line
+    return " ".join("".join(result).split())
 
 
 def _segmentbywords_botok(in_str):
+    tokens = _botok_spans(in_str)
+    if tokens is None:
+        return in_str
+    return _join_tokens(in_str, tokens)
+
+def _botok_spans(in_str):
+    """(start, end) of each botok token of in_str, None if botok failed."""
+    timed = metrics.ENABLED
+    if timed:
+        start = time.perf_counter()
     try:
         t = Text(in_str, tok_params={'profile': 'GMD'})
         tokens = t.custom_pipeline('dummy', _botok_tokenizer, _botok_modifier, 'dummy')
     except Exception as e:
         print(e)
         print("botok failed to segment "+in_str)
-        return in_str
-    res = ''
-    first = True
-    for token in tokens:
-        if not first:
-            res += " "
-        first = False
-        res += in_str[token['start']:token['end']]
-    res = _presegment(res)
-    res = _postsegment(res)
+        return None
+    if timed:
+        metrics.observe('botok', time.perf_counter() - start)
+    return [(token['start'], token['end']) for token in tokens]
+
+_TOKEN_EDGE = re.compile(r"[\s\u0F0B\u0F0C]*")
+
+def _spans_within(line, tokens, start, end):
+    """
+    The tokens of line[start:end], cut out of the tokens of the whole line.
+    Returns None when a token runs over the edge of the fragment (botok read
+    the fragment differently in context), the caller then tokenizes the
+    fragment on its own. Only whitespace and tshegs may be cut off a token.
+    """
+    spans = []
+    for token_start, token_end in tokens:
+        if token_end <= start or token_start >= end:
+            continue
+        if token_start < start or token_end > end:
+            inner_start, inner_end = max(token_start, start), min(token_end, end)
+            outer = line[token_start:inner_start] + line[inner_end:token_end]
+            if not (_TOKEN_EDGE.fullmatch(outer) or _TOKEN_EDGE.fullmatch(line, inner_start, inner_end)):
+                return None
+            token_start, token_end = inner_start, inner_end
+        spans.append((token_start, token_end))
+    return spans
+
+def _join_tokens(in_str, tokens):
+    """Space-separated tokens of in_str, after the MA and particle rules."""
+    timed = metrics.ENABLED
+    res = " ".join(in_str[start:end] for start, end in tokens)
+    if timed:
+        start = time.perf_counter()
+    res = _SEGMENT_RULES.apply(res)
+    if timed:
+        metrics.observe('postsegment', time.perf_counter() - start)
     return res
 
 def _botok_tokenizer(in_str):
-    return WT.tokenize(in_str)
+    return _resource('WT').tokenize(in_str)
 
 def _botok_modifier(tokens):
     op = []
@@ -305,17 +734,25 @@ def _botok_modifier(tokens):
     return op
 
 # Splits MA prefix that should always be separate
-def _presegment(in_str):
-    in_str = re.sub(r"(^| )(མ)་", r" \2་ ", in_str)
-    return in_str
+_PRESEGMENT_RULES = RuleSet(
+    Rule(r"(^| )(མ)་", r" \2་ ", triggers=["མ་"]),
+)
 
-def _postsegment(in_str):
+_POSTSEGMENT_RULES = RuleSet(
     # Combine particle with previous syllable when there is just one
-    in_str = re.sub(r"(^| )([^ ]+)[\u0F0B\u0F0C] +(མེད|བ|པ|བོ|ཝོ|མོ|བའི|བས|བའོ|པའི|པར|པས|པའོ|བོའི|བོར|བོས|བོའོ|པོའི|པོར|པོས|པོའོ|མའི|མས|མའོ|མོའི|མོར|མོའོ)($|[ ་-༔])", r"\1\2་\3\4", in_str)
-    in_str = re.sub(r"([\u0F40-\u0FBC]) +([\u0F40-\u0FBC])", r"\1\2", in_str)
+    Rule(r"(^| )([^ ]+)[\u0F0B\u0F0C] +(མེད|བ|པ|བོ|ཝོ|མོ|བའི|བས|བའོ|པའི|པར|པས|པའོ|བོའི|བོར|བོས|བོའོ|པོའི|པོར|པོས|པོའོ|མའི|མས|མའོ|མོའི|མོར|མོའོ)($|[ ་-༔])", r"\1\2་\3\4", triggers=["\u0F0B ", "\u0F0C "]),
+    Rule(r"([\u0F40-\u0FBC]) +([\u0F40-\u0FBC])", r"\1\2", triggers=[" "]),
     # Make sure imperative endings are separate (chik, shok)
-    in_str = re.sub(r"(གཅིག|ཅིག|ཞིག|ཤིགས|ཤིག|ཞོགས|ཤོགས|ཤོག|ཞོག)($|[ ་-༔])", r" \1\2", in_str)
-    return in_str
+    Rule(r"(གཅིག|ཅིག|ཞིག|ཤིགས|ཤིག|ཞོགས|ཤོགས|ཤོག|ཞོག)($|[ ་-༔])", r" \1\2", triggers=["ཅིག", "ཞིག", "ཤིག", "ཞོག", "ཤོག"]),
+)
+
+_SEGMENT_RULES = _PRESEGMENT_RULES + _POSTSEGMENT_RULES
+
+def _presegment(in_str):
+    return _PRESEGMENT_RULES.apply(in_str)
+
+def _postsegment(in_str):
+    return _POSTSEGMENT_RULES.apply(in_str)
 
 def _load_segmentation_exceptions():
     exceptions = {}
@@ -332,7 +769,168 @@ def _load_segmentation_exceptions():
         print(f"Could not load segment exceptions: {e}")
     return exceptions
 
-_segmentation_exceptions = _load_segmentation_exceptions()
+def _build_exceptions_trie(exceptions):
+    """Character trie over the exception keys; the empty key holds the complete exception."""
+    trie = {}
+    for orig in exceptions:
+        node = trie
+        for char in orig:
+            node = node.setdefault(char, {})
+        node[''] = orig
+    return trie
+
+def reload_segmentation_exceptions():
+    """(Re)load segmentation_exceptions.csv and rebuild the exceptions matcher."""
+    global _segmentation_exceptions, _exceptions_matcher
+    _segmentation_exceptions = _load_segmentation_exceptions()
+    _exceptions_matcher = (_segmentation_exceptions, _build_exceptions_trie(_segmentation_exceptions))
+
+_RESOURCE_BUILDERS['_segmentation_exceptions'] = ('segmentation_exceptions', lambda: _resource('_PRECOMPILED')['segmentation_exceptions'])
+_RESOURCE_BUILDERS['_exceptions_matcher'] = ('exceptions_matcher', lambda: (_resource('_segmentation_exceptions'), _resource('_PRECOMPILED')['exceptions_trie']))
+
+def _split_on_exceptions(line):
+    """
+    Split a line around segmentation exceptions, like re.split with a capturing
+    alternation of all exceptions (longest first): non-exception text and
+    exceptions alternate, starting and ending with (possibly empty) text.
+    """
+    global _exceptions_matcher
+    exceptions = _resource('_segmentation_exceptions')
+    source, trie = _resource('_exceptions_matcher')
+    if source is not exceptions:
+        # _segmentation_exceptions was replaced, rebuild the matcher once
+        trie = _build_exceptions_trie(exceptions)
+        _exceptions_matcher = (exceptions, trie)
+    parts = []
+    last_end = 0
+    i = 0
+    length = len(line)
+    while i < length:
+        node = trie.get(line[i])
+        match = None
+        end = i + 1
+        while node is not None:
+            if '' in node:
+                match = node['']
+            if end == length:
+                break
+            node = node.get(line[end])
+            end += 1
+        if match is None:
+            i += 1
+            continue
+        parts.append(line[last_end:i])
+        parts.append(match)
+        i = last_end = i + len(match)
+    parts.append(line[last_end:])
+    return parts
+
+def _precompiled_source_hash():
+    """Hash of everything the precompiled tables are built from."""
+    sources = [os.path.abspath(__file__), os.path.join(os.path.dirname(__file__), "segmentation_exceptions.csv")]
+    if tibetan_sanskrit_transliteration_data is not None:
+        sources.append(str(tibetan_sanskrit_transliteration_data.get_replacements_path()))
+    digest = hashlib.sha1()
+    for path in sources:
+        try:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(b'missing')
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _build_precompiled():
+    exceptions = _load_segmentation_exceptions()
+    return {
+        'sanskrit_index': _build_sanskrit_index(_resource('_SANSKRIT_PATTERNS')),
+        'segmentation_exceptions': exceptions,
+        'exceptions_trie': _build_exceptions_trie(exceptions),
+    }
+
+def _load_precompiled():
+    """
+    Load the Sanskrit index and segmentation exceptions tables from
+    CACHE_DIR/precompiled.pickle, rebuilding (and saving) them when the file
+    is missing or was built from different sources.
+    """
+    source_hash = _precompiled_source_hash()
+    path = os.path.join(CACHE_DIR, 'precompiled.pickle')
+    try:
+        with open(path, 'rb') as f:
+            saved = pickle.load(f)
+        if saved.get('source_hash') == source_hash:
+            return saved['tables']
+    except Exception:
+        pass
+    tables = _build_precompiled()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({ 'source_hash': source_hash, 'tables': tables }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not save precompiled tables: {e}")
+    return tables
+
+_RESOURCE_BUILDERS['_PRECOMPILED'] = ('precompiled_tables', _load_precompiled)
+
+def _data_version():
+    """
+    Version of everything conversion results depend on: the precompiled
+    sources (this file, the exceptions and Sanskrit replacements) and the
+    versions of botok, bophono and the transliteration data.
+    """
+    from importlib import metadata
+    digest = hashlib.sha1(_precompiled_source_hash().encode())
+    for package in ('botok', 'bophono', 'tibetan-sanskrit-transliteration-data'):
+        try:
+            digest.update(f"{package}={metadata.version(package)}".encode())
+        except metadata.PackageNotFoundError:
+            digest.update(f"{package}=none".encode())
+    return digest.hexdigest()
+
+_RESOURCE_BUILDERS['_DATA_VERSION'] = ('data_version', _data_version)
+
+def data_version():
+    """Version of the conversion results (see _data_version), computed once."""
+    return _resource('_DATA_VERSION')
+
+def _open_persistent_cache():
+    """
+    The PersistentCache set with KVP_PERSISTENT_CACHE (a file path, or 1 for
+    CACHE_DIR/results.sqlite), keeping about KVP_PERSISTENT_CACHE_MAX_ROWS
+    entries (default 1000000, 0 for no bound), False when it is not set.
+    """
+    path = os.environ.get('KVP_PERSISTENT_CACHE', '')
+    if path in ('', '0'):
+        return False
+    if path == '1':
+        path = os.path.join(CACHE_DIR, 'results.sqlite')
+    try:
+        return PersistentCache(path, data_version(), int(os.environ.get('KVP_PERSISTENT_CACHE_MAX_ROWS', 1000000)))
+    except Exception as e:
+        print(f"Could not open persistent cache {path}: {e}")
+        return False
+
+_RESOURCE_BUILDERS['_PERSISTENT_CACHE'] = ('persistent_cache', _open_persistent_cache)
+
+def persistent_cache_stats():
+    """Return the persistent cache's size and hit/miss counters, None when it is not enabled."""
+    persistent = _resource('_PERSISTENT_CACHE')
+    return persistent.stats() if persistent else None
+
+def drop_old_persistent_entries():
+    """
+    Delete the persistent cache entries of other data versions, once no
+    process of those versions uses the file. Returns how many there were.
+    """
+    persistent = _resource('_PERSISTENT_CACHE')
+    return persistent.drop_other_versions() if persistent else 0
+
+def _persistent_key(*parts):
+    return '\x1f'.join(str(part) for part in parts)
 
 def _enforce_tshegs_at_the_end(in_str):
     in_str = in_str.rstrip()
@@ -340,84 +938,323 @@ def _enforce_tshegs_at_the_end(in_str):
         in_str += "་"
     return in_str
 
-def _clean_phono_output(phon_str):
-    """Clean up phonetic output: merge consecutive (?) markers and trim spaces"""
+_CLEAN_PHONO_RULES = RuleSet(
     # Merge consecutive (?) markers (with optional spaces between), keep one trailing space
-    phon_str = re.sub(r'\(\?\)(\s*\(\?\))+', '(?)', phon_str)
+    Rule(r'\(\?\)(\s*\(\?\))+', '(?)', triggers=["(?)"]),
     # Collapse multiple spaces into one
-    phon_str = re.sub(r'  +', ' ', phon_str)
+    Rule(r'  +', ' ', triggers=["  "]),
     # Remove trailing space before newline or end
-    phon_str = re.sub(r' +(\n|$)', r'\1', phon_str)
-    return phon_str
+    Rule(r' +(\n|$)', r'\1'),
+)
 
-def add_phono(in_str, res, sanskrit_mode=None, anusvara_style='ṃ'):
+def _clean_phono_output(phon_str):
+    """Clean up phonetic output: merge consecutive (?) markers and trim spaces"""
+    return _CLEAN_PHONO_RULES.apply(phon_str)
+
+# Output schemas of add_phono: result key -> name of the bophono converter resource.
+# To add a schema, register its converter in _RESOURCE_BUILDERS and add it here.
+SCHEMAS = {
+    'kvp': 'PHON_KVP',
+    'ipa': 'PHON_API',
+}
+
+def _sanskrit_output(transliteration, phonetics, sanskrit_mode, anusvara_style):
+    """Text replacing a Sanskrit match, depending on sanskrit_mode."""
+    if sanskrit_mode == 'iast':
+        output = transliteration
+        if anusvara_style == 'ṁ':
+            output = output.replace('ṃ', 'ṁ')
+        return output
+    if sanskrit_mode == 'phonetics':
+        return phonetics
+    return '(?)'
+
+def _word_parts(word, sanskrit_mode, anusvara_style):
+    """
+    Split a word into its Tibetan and Sanskrit parts.
+    Returns list of (tibetan, output) tuples: tibetan is the fragment to
+    phoneticize, or None for Sanskrit parts whose output is already known.
+    """
+    # Process word to find Sanskrit patterns
+    if metrics.ENABLED:
+        start = time.perf_counter()
+        matches = _find_sanskrit_matches(word)
+        metrics.observe('sanskrit', time.perf_counter() - start)
+        metrics.count('sanskrit_matches', len(matches))
+    else:
+        matches = _find_sanskrit_matches(word)
+    if not matches:
+        # No Sanskrit - just phoneticize the whole word
+        return [(word, None)]
+    
+    parts = []
+    last_end = 0
+    for start, end, transliteration, phonetics in matches:
+        # Add any Tibetan text before this match
+        if start > last_end:
+            tibetan_part = word[last_end:start]
+            if tibetan_part.strip('་'):
+                parts.append((tibetan_part, None))
+        parts.append((None, _sanskrit_output(transliteration, phonetics, sanskrit_mode, anusvara_style)))
+        last_end = end
+    
+    # Add any remaining Tibetan text after the last match
+    if last_end < len(word):
+        tibetan_part = word[last_end:]
+        if tibetan_part.strip('་'):
+            parts.append((tibetan_part, None))
+    return parts
+
+def _check_schemas(schemas):
+    """Return schemas as a list (all of SCHEMAS if None), raising ValueError for unknown ones."""
+    if schemas is None:
+        return list(SCHEMAS)
+    schemas = list(schemas)
+    for schema in schemas:
+        if schema not in SCHEMAS:
+            raise ValueError(f"unknown schema {schema!r}, expected one of {', '.join(SCHEMAS)}")
+    return schemas
+
+def _plan_words(segmentations):
+    """
+    Collect the distinct words of Segmentations, normalized, so each is converted once.
+    Returns (words, layouts): words lists each distinct normalized word once,
+    and for each segmentation its layout is a list of lines, each a list of
+    indexes into words. Normalizing word by word gives the words of the
+    normalized text: normalization neither adds nor removes whitespace.
+    """
+    # Word as written and normalized -> index into words
+    index = {}
+    normalized = {}
+    layouts = []
+    for segmentation in segmentations:
+        layout = []
+        for words in segmentation.line_words():
+            line = []
+            for word in words:
+                i = index.get(word)
+                if i is None:
+                    normalized_word = _normalize_tibetan(word)
+                    i = normalized.get(normalized_word)
+                    if i is None:
+                        i = normalized[normalized_word] = len(normalized)
+                    index[word] = i
+                line.append(i)
+            layout.append(line)
+        layouts.append(layout)
+    return list(normalized), layouts
+
+def _phonetize_words(words, converters, sanskrit_mode, anusvara_style):
+    """For each converter, the output of every word (Tibetan parts phoneticized, Sanskrit parts rendered)."""
+    persistent = _resource('_PERSISTENT_CACHE')
+    if not persistent:
+        return _convert_words(words, converters, sanskrit_mode, anusvara_style)
+    keys = [
+        [_persistent_key('phono', phon.schema, sorted(phon.options.items()), sanskrit_mode, anusvara_style, word) for word in words]
+        for phon in converters
+    ]
+    stored = persistent.get_many({ key for converter_keys in keys for key in converter_keys })
+    missing = [i for i, word in enumerate(words) if any(converter_keys[i] not in stored for converter_keys in keys)]
+    if missing:
+        computed = _convert_words([words[i] for i in missing], converters, sanskrit_mode, anusvara_style)
+        new_items = []
+        for converter_keys, output in zip(keys, computed):
+            for i, word_output in zip(missing, output):
+                stored[converter_keys[i]] = word_output
+                new_items.append((converter_keys[i], word_output))
+        persistent.put_many(new_items)
+    return [[stored[key] for key in converter_keys] for converter_keys in keys]
+
+def _convert_words(words, converters, sanskrit_mode, anusvara_style):
+    outputs = [[] for _ in converters]
+    for word in words:
+        limits.check()
+        parts = _word_parts(word, sanskrit_mode, anusvara_style)
+        for phon, output in zip(converters, outputs):
+            output.append(' '.join(_get_api(phon, tibetan) if tibetan is not None else sanskrit for tibetan, sanskrit in parts))
+    return outputs
+
+def _assemble(layout, word_outputs):
+    return ''.join(''.join(word_outputs[i] + ' ' for i in line) + "\n" for line in layout)
+
+def add_phono_many(in_strs, results, sanskrit_mode=None, anusvara_style='ṃ', schemas=None):
+    """
+    add_phono for several texts at once: the distinct words of all the texts
+    are converted once and the outputs put back together in order.
+    in_strs are segmented strings or Segmentations, results is a list of
+    dictionaries, one per text.
+    """
+    schemas = _check_schemas(schemas)
+    converters = [_resource(SCHEMAS[schema]) for schema in schemas]
+    timed = metrics.ENABLED
+    if timed:
+        start = time.perf_counter()
+    segmentations = [in_str if isinstance(in_str, Segmentation) else Segmentation(in_str) for in_str in in_strs]
+    words, layouts = _plan_words(segmentations)
+    if timed:
+        metrics.observe('normalize', time.perf_counter() - start)
+    if timed:
+        metrics.count('words', sum(len(line) for layout in layouts for line in layout))
+        metrics.count('distinct_words', len(words))
+    outputs = _phonetize_words(words, converters, sanskrit_mode, anusvara_style)
+    
+    if timed:
+        start = time.perf_counter()
+    for layout, res in zip(layouts, results):
+        for schema, output in zip(schemas, outputs):
+            res[schema] = _clean_phono_output(_assemble(layout, output))
+    if timed:
+        metrics.observe('clean_output', time.perf_counter() - start)
+
+def add_phono(in_str, res, sanskrit_mode=None, anusvara_style='ṃ', schemas=None):
     """
     Add phonetic transcriptions to the result dictionary.
     
     Args:
-        in_str: Input Tibetan text (segmented)
+        in_str: Input Tibetan text (segmented), or a Segmentation
         res: Result dictionary to populate
         sanskrit_mode: None/'keep' for (?) markers, 'iast' for IAST, 'phonetics' for phonetic
         anusvara_style: 'ṃ' (default) or 'ṁ' for anusvara character
+        schemas: keys of SCHEMAS to compute (default all), only their converters run
     """
-    # Normalize Tibetan input first
-    in_str = _normalize_tibetan(in_str)
-    lines = in_str.split("\n")
-    res_kvp = ""
-    res_ipa = ""
-    
-    for l in lines:
-        words = l.split()
-        for word in words:
-            # Process word to find Sanskrit patterns
-            # Remove spaces but keep the word boundary
-            matches = _find_sanskrit_matches(word)
-            
-            if not matches:
-                # No Sanskrit - just phoneticize the whole word
-                res_kvp += PHON_KVP.get_api(word) + ' '
-                res_ipa += PHON_API.get_api(word) + ' '
-                continue
-            
-            # Process parts of the word
-            kvp_parts = []
-            ipa_parts = []
-            last_end = 0
-            
-            for start, end, transliteration, phonetics in matches:
-                # Add any Tibetan text before this match
-                if start > last_end:
-                    tibetan_part = word[last_end:start]
-                    if tibetan_part.strip('་'):
-                        kvp_parts.append(PHON_KVP.get_api(tibetan_part))
-                        ipa_parts.append(PHON_API.get_api(tibetan_part))
-                
-                # Determine Sanskrit output based on mode
-                if sanskrit_mode == 'iast':
-                    output = transliteration
-                    if anusvara_style == 'ṁ':
-                        output = output.replace('ṃ', 'ṁ')
-                elif sanskrit_mode == 'phonetics':
-                    output = phonetics
-                else:
-                    output = '(?)'
-                
-                kvp_parts.append(output)
-                ipa_parts.append(output)
-                last_end = end
-            
-            # Add any remaining Tibetan text after the last match
-            if last_end < len(word):
-                tibetan_part = word[last_end:]
-                if tibetan_part.strip('་'):
-                    kvp_parts.append(PHON_KVP.get_api(tibetan_part))
-                    ipa_parts.append(PHON_API.get_api(tibetan_part))
-            
-            res_kvp += ' '.join(kvp_parts) + ' '
-            res_ipa += ' '.join(ipa_parts) + ' '
-        
-        res_kvp += "\n"
-        res_ipa += "\n"
+    add_phono_many([in_str], [res], sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+
+SEGMENTERS = {
+    'words': segmentbywords,
+    'two': segmentbytwo,
+    'one': segmentbyone,
+}
+
+# The same, returning a Segmentation
+_SEGMENTATIONS = {
+    'words': _segmentation_by_words,
+    'two': _segmentation_by_two,
+    'one': _segmentation_by_one,
+}
+
+def convert(in_str, mode='words', sanskrit_mode=None, anusvara_style='ṃ', schemas=None):
+    """
+    Segment in_str and add its phonetics, returning the same dictionary as the server routes.
     
-    res["kvp"] = _clean_phono_output(res_kvp)
-    res["ipa"] = _clean_phono_output(res_ipa)
\ No newline at end of file
+    Args:
+        in_str: Input Tibetan text
+        mode: 'words', 'two' or 'one' (see SEGMENTERS), or 'none' to phoneticize in_str as already segmented
+        sanskrit_mode, anusvara_style, schemas: see add_phono
+    """
+    schemas = _check_schemas(schemas)
+    if mode == 'none':
+        res = {}
+        seg = in_str
+    else:
+        seg = _SEGMENTATIONS[mode](in_str)
+        res = { "segmented" : str(seg) }
+    add_phono(seg, res, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+    return res
+
+def convert_many(in_strs, mode='words', sanskrit_mode=None, anusvara_style='ṃ', schemas=None):
+    """
+    convert for several texts with the same options, phoneticizing the
+    distinct words of all of them once (see add_phono_many). Returns one
+    result per text, in order.
+    """
+    schemas = _check_schemas(schemas)
+    if mode == 'none':
+        results = [{} for _ in in_strs]
+        segs = list(in_strs)
+    else:
+        segs = [_SEGMENTATIONS[mode](in_str) for in_str in in_strs]
+        results = [{ "segmented" : str(seg) } for seg in segs]
+    add_phono_many(segs, results, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+    return results
+
+# Streaming conversion: the same pipeline, one line at a time, so long texts
+# give their first lines at once and never hold the whole output in memory.
+
+# Line boundaries of str.splitlines
+_LINE_BREAK = re.compile(r"\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+
+def _iter_splitlines(text):
+    """Lazy text.splitlines()."""
+    pos = 0
+    for m in _LINE_BREAK.finditer(text):
+        yield text[pos:m.start()]
+        pos = m.end()
+    if pos < len(text):
+        yield text[pos:]
+
+def _iter_split(text, sep):
+    """Lazy text.split(sep)."""
+    pos = 0
+    while True:
+        end = text.find(sep, pos)
+        if end < 0:
+            yield text[pos:]
+            return
+        yield text[pos:end]
+        pos = end + len(sep)
+
+def _iter_enforced_lines(in_str):
+    """Lazy _enforce_tshegs_at_the_end(in_str).split("\n")."""
+    text = in_str.rstrip()
+    pos = 0
+    while True:
+        end = text.find("\n", pos)
+        if end < 0:
+            # Only the last line can need a final tsheg
+            yield _enforce_tshegs_at_the_end(text[pos:])
+            return
+        yield text[pos:end]
+        pos = end + 1
+
+def iter_segmentbywords(in_str):
+    """The lines of segmentbywords(in_str), one at a time."""
+    for line in _iter_splitlines(in_str):
+        yield _segment_lines_by_words([line])[0]
+
+def iter_segmentbyone(in_str):
+    """The lines of segmentbyone(in_str), one at a time (without their "\n")."""
+    for line in _iter_enforced_lines(in_str):
+        yield _segment_line_by_one(line)
+
+def iter_segmentbytwo(in_str):
+    """The lines of segmentbytwo(in_str), one at a time (without their "\n")."""
+    for line in _iter_enforced_lines(in_str):
+        yield _segment_line_by_two(line)
+
+ITER_SEGMENTERS = {
+    'words': iter_segmentbywords,
+    'two': iter_segmentbytwo,
+    'one': iter_segmentbyone,
+}
+
+def _phono_line(line, schemas, converters, sanskrit_mode, anusvara_style):
+    words, layouts = _plan_words([Segmentation(line)])
+    outputs = _phonetize_words(words, converters, sanskrit_mode, anusvara_style)
+    return { schema : _clean_phono_output(_assemble(layouts[0], output))[:-1] for schema, output in zip(schemas, outputs) }
+
+def iter_add_phono(lines, sanskrit_mode=None, anusvara_style='ṃ', schemas=None):
+    """
+    add_phono for an iterable of segmented lines: yields { schema: phonetics }
+    for each line as soon as it is converted. Unlike add_phono, (?) markers
+    at the end of a line and the start of the next one are not merged.
+    """
+    schemas = _check_schemas(schemas)
+    converters = [_resource(SCHEMAS[schema]) for schema in schemas]
+    for line in lines:
+        yield _phono_line(line, schemas, converters, sanskrit_mode, anusvara_style)
+
+def iter_convert(in_str, mode='words', sanskrit_mode=None, anusvara_style='ṃ', schemas=None):
+    """
+    convert, one line at a time: yields for each line the fields of convert
+    ("segmented" unless mode is 'none', and the schemas) for that line,
+    without its newline.
+    """
+    schemas = _check_schemas(schemas)
+    if mode == 'none':
+        yield from iter_add_phono(_iter_split(in_str, "\n"), sanskrit_mode, anusvara_style, schemas)
+        return
+    converters = [_resource(SCHEMAS[schema]) for schema in schemas]
+    for seg in ITER_SEGMENTERS[mode](in_str):
+        res = { "segmented" : seg }
+        res.update(_phono_line(seg, schemas, converters, sanskrit_mode, anusvara_style))
+        yield res
@@ -0,0 +1,157 @@
+"""
+Preforking production launcher.
+
+The master process imports server.py, which builds botok's tokenizer, the
+bophono converters and the Sanskrit and exception tables (see
+phonetics.warm_up), freezes the heap with gc.freeze() and forks the workers.
+The workers serve the Flask app on the master's listening socket and share
+those tables copy-on-write instead of each building its own copy.
+
+    $ python prefork.py --workers 8 --port 5000
+
+Memory per process (RSS, the part shared with other processes, the private
+part and PSS) is printed once the workers are up and on SIGUSR1:
+
+    $ kill -USR1 <master pid>
+
+Dead workers are replaced; SIGTERM or SIGINT stops the master and its workers.
+Linux only (fork, /proc).
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+def memory_usage(pid):
+    """
+    Memory of a process from /proc/<pid>/smaps_rollup, in bytes:
+    { "rss", "shared", "private", "pss" }. None if it can't be read.
+    """
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        "rss" : fields.get("Rss", 0),
+        "shared" : fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private" : fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "pss" : fields.get("Pss", 0),
+    }
+
+def _mb(n):
+    return f"{n / (1024 * 1024):7.1f} MB"
+
+def report(master_pid, workers, out=None):
+    """Print the memory of the master and of each worker."""
+    out = out or sys.stderr
+    total_pss = 0
+    for name, pid in [("master", master_pid)] + [(f"worker {i}", pid) for i, pid in enumerate(workers)]:
+        usage = memory_usage(pid)
+        if usage is None:
+            print(f"{name:10} {pid:>7}: memory not available", file=out)
+            continue
+        total_pss += usage["pss"]
+        print(f"{name:10} {pid:>7}: rss {_mb(usage['rss'])}  shared {_mb(usage['shared'])}  private {_mb(usage['private'])}  pss {_mb(usage['pss'])}", file=out)
+    print(f"{'total pss':18}: {_mb(total_pss)}", file=out)
+    out.flush()
+
+def _serve(sock, threaded):
+    from werkzeug.serving import make_server
+    from server import api
+    # Objects allocated from now on are collected as usual, the frozen ones
+    # are never touched by the collector so their pages stay shared
+    gc.enable()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, api, threaded=threaded, fd=sock.fileno())
+    server.serve_forever()
+
+def _spawn(sock, threaded):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _serve(sock, threaded)
+        finally:
+            os._exit(1)
+    return pid
+
+def run(args):
+    # Keep the collector from touching (and so copying) the shared objects
+    # while the app loads, then move them to the permanent generation
+    gc.disable()
+    sock = socket.create_server((args.host, args.port), backlog=args.backlog)
+    sock.set_inheritable(True)
+    import server  # noqa: F401 (builds the tokenizer and tables, unless KVP_WARM_UP=0)
+    gc.freeze()
+
+    master_pid = os.getpid()
+    workers = [_spawn(sock, args.threaded) for _ in range(args.workers)]
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers (master {master_pid})", file=sys.stderr)
+
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    report_requested = args.report_after is not None
+    def request_report(signum, frame):
+        nonlocal report_requested
+        report_requested = True
+    signal.signal(signal.SIGUSR1, request_report)
+    report_at = time.monotonic() + (args.report_after or 0)
+
+    while not stopping:
+        if report_requested and time.monotonic() >= report_at:
+            report_requested = False
+            report(master_pid, workers)
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid and pid in workers:
+            print(f"worker {pid} exited with status {status}, restarting it", file=sys.stderr)
+            workers[workers.index(pid)] = _spawn(sock, args.threaded)
+        time.sleep(0.2)
+
+    for pid in workers:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for pid in workers:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+    sock.close()
+    return 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the phonetics API from preforked workers sharing the tokenizer and tables.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="worker processes (default: one per core)")
+    parser.add_argument("--threaded", action="store_true", help="serve each worker's requests on threads")
+    parser.add_argument("--backlog", type=int, default=128)
+    parser.add_argument("--report-after", type=float, default=5.0, help="seconds after startup to print the memory report (negative to skip)")
+    args = parser.parse_args(argv)
+    if args.report_after < 0:
+        args.report_after = None
+    return args
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+if __name__ == "__main__":
+    sys.exit(main())
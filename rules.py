@@ -0,0 +1,53 @@
+"""
+Ordered regex rewrite rules, compiled once.
+
+A RuleSet applies its rules in order, each one to the output of the previous
+one, like a chain of re.sub calls. A rule can list substrings its pattern
+can't match without (triggers): when none of them is in the text, the rule is
+skipped without running the regex.
+"""
+import re
+
+class Rule:
+    def __init__(self, pattern, replacement, triggers=None):
+        self.regex = re.compile(pattern)
+        self.replacement = replacement
+        self.triggers = tuple(triggers) if triggers else None
+
+    def could_apply(self, text):
+        """False when the rule certainly doesn't match text."""
+        return self.triggers is None or any(trigger in text for trigger in self.triggers)
+
+    def matches(self, text):
+        return self.could_apply(text) and self.regex.search(text) is not None
+
+    def apply(self, text):
+        if not self.could_apply(text):
+            return text
+        return self.regex.sub(self.replacement, text)
+
+class RuleSet:
+    def __init__(self, *rules):
+        self.rules = rules
+
+    def __add__(self, other):
+        return RuleSet(*self.rules, *other.rules)
+
+    def apply(self, text):
+        for rule in self.rules:
+            text = rule.apply(text)
+        return text
+
+    def would_change(self, text):
+        """
+        Whether apply(text) != text. Only searches the text unless a rule
+        matches: a later rule could undo what it changed, so the remaining
+        rules are then applied and the result compared.
+        """
+        for i, rule in enumerate(self.rules):
+            if rule.matches(text):
+                changed = text
+                for rule in self.rules[i:]:
+                    changed = rule.apply(changed)
+                return changed != text
+        return False
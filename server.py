@@ -1,54 +1,350 @@
-from flask import Flask, json, request
+from flask import Flask, Response, json, request, send_from_directory
+import hashlib
+import mimetypes
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../bophono')))
-from phonetics import segmentbywords, segmentbytwo, segmentbyone, add_phono
+from phonetics import convert, convert_many, iter_convert, warm_up, data_version, lexicon_stats, persistent_cache_stats, SEGMENTERS, SCHEMAS, PHON_CACHE
+from cache import LRUCache
+from incremental import convert_lines, LINE_CACHE
+import assets
+import limits
+import metrics
 from flask_cors import CORS
 
 api = Flask("KVP", static_url_path='', static_folder='web/')
 CORS(api)
 
+MODES = set(SEGMENTERS) | {'none'}
+
+# Hashed, precompressed copies of web/ built by python assets.py, {} to serve web/ as is
+ASSETS = assets.load()
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.environ.get('KVP_COMPRESS_MIN_BYTES', 1400))
+COMPRESSED_TYPES = {'application/json', 'text/html', 'text/plain'}
+
+# Response bodies by content key (see _cached_response), at most
+# KVP_RESPONSE_CACHE_SIZE of them and KVP_RESPONSE_CACHE_TOTAL_CHARS characters
+# in all per process (0 for no bound)
+RESPONSE_CACHE_TOTAL_CHARS = int(os.environ.get('KVP_RESPONSE_CACHE_TOTAL_CHARS', 20000000))
+RESPONSE_CACHE = LRUCache(int(os.environ.get('KVP_RESPONSE_CACHE_SIZE', 1000)), RESPONSE_CACHE_TOTAL_CHARS, len)
+# Longer bodies are not kept (0 for no limit), so a few whole books can't flush the cache
+RESPONSE_CACHE_MAX_CHARS = int(os.environ.get('KVP_RESPONSE_CACHE_MAX_CHARS', 100000))
+
+# Load the tokenizer, converters and tables before serving the first request
+if os.environ.get('KVP_WARM_UP', '1') != '0':
+    startup_times = warm_up()
+    print("Startup: " + ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in startup_times.items()))
+
 def _get_sanskrit_options():
     """Extract Sanskrit options from request form data."""
     sanskrit_mode = request.form.get('sanskrit_mode', None)
     anusvara_style = request.form.get('anusvara_style', 'ṃ')
     return sanskrit_mode, anusvara_style
 
-@api.route('/segmentbywords', methods=['POST'])
-def segment_and_phon():
+def _parse_schemas(value):
+    """
+    Output schemas requested as a list or a comma-separated string ("kvp,ipa").
+    Returns None (all schemas) when not given, raises ValueError for unknown schemas.
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(schema, str) and schema.strip() in SCHEMAS for schema in value):
+        raise ValueError(f'"schemas" must be a list of {", ".join(SCHEMAS)}')
+    return tuple(schema.strip() for schema in value)
+
+def _json_options(obj):
+    """
+    (mode, sanskrit_mode, anusvara_style, schemas) of a JSON request object,
+    raising ValueError for invalid ones.
+    """
+    mode = obj.get('mode', 'words')
+    if not isinstance(mode, str) or mode not in MODES:
+        raise ValueError(f'unknown mode "{mode}"')
+    sanskrit_mode = obj.get('sanskrit_mode')
+    if sanskrit_mode is not None and not isinstance(sanskrit_mode, str):
+        raise ValueError('"sanskrit_mode" must be a string')
+    anusvara_style = obj.get('anusvara_style', 'ṃ')
+    if not isinstance(anusvara_style, str):
+        raise ValueError('"anusvara_style" must be a string')
+    return mode, sanskrit_mode, anusvara_style, _parse_schemas(obj.get('schemas'))
+
+def _wants_timing(value):
+    """Per-request timing is only available while metrics are enabled (KVP_METRICS=1)."""
+    return metrics.ENABLED and value not in (None, '', '0', 'false', False, 0)
+
+def _timing_ms(timings):
+    return { stage : round(seconds * 1000, 3) for stage, seconds in timings.items() }
+
+def _content_key(route, payload):
+    """Hash of everything a response depends on: the route, its input and options, and the data version."""
+    content = json.dumps([data_version(), route, payload], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def _cached_response(route, payload, compute, headers=None):
+    """
+    The response body compute() returns for payload, through RESPONSE_CACHE.
+    Its content key is sent as the ETag, so a client sending it back in
+    If-None-Match gets a 304 without anything being converted, and as
+    Content-Location: /result/<key> serves the body to GET while it is cached.
+    X-Cache tells whether the body came from the cache (HIT) or not (MISS).
+    """
+    key = _content_key(route, payload)
+    headers = dict(headers or {}, ETag=f'"{key}"')
+    # Weak as the compressed bodies carry it too (see compress_response)
+    if request.if_none_match.contains_weak(key):
+        return '', 304, headers
+    body = RESPONSE_CACHE.get(key)
+    headers['X-Cache'] = 'HIT' if body is not None else 'MISS'
+    if body is None:
+        body = compute()
+        if _cacheable(body):
+            RESPONSE_CACHE.put(key, body)
+    if _cacheable(body):
+        headers['Content-Location'] = f'/result/{key}'
+    return body, 200, headers
+
+def _cacheable(body):
+    return all(not limit or len(body) <= limit for limit in (RESPONSE_CACHE_MAX_CHARS, RESPONSE_CACHE_TOTAL_CHARS))
+
+def _convert_form(mode):
     in_str = request.form['str']
     sanskrit_mode, anusvara_style = _get_sanskrit_options()
-    seg = segmentbywords(in_str)
-    res = { "segmented" : seg }
-    add_phono(seg, res, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style)
+    try:
+        schemas = _parse_schemas(request.form.get('schemas'))
+    except ValueError as e:
+        return _json_error(str(e))
+    limits.check_texts([in_str])
+    if not _wants_timing(request.form.get('timing')):
+        def compute():
+            with limits.budget():
+                res = convert(in_str, mode, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+            return json.dumps(res, ensure_ascii=False)
+        payload = { "str" : in_str, "sanskrit_mode" : sanskrit_mode, "anusvara_style" : anusvara_style, "schemas" : schemas }
+        return _cached_response(mode, payload, compute)
+    with metrics.collect() as timings, limits.budget():
+        res = convert(in_str, mode, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+    res["timing"] = _timing_ms(timings)
     return json.dumps(res, ensure_ascii=False)
 
-@api.route('/segmentbyone', methods=['POST'])
-def segmentbyone_and_phon():
+def _stream_form(mode):
+    """
+    Streaming variant of _convert_form: NDJSON, one object per line of the
+    input with that line's fields, sent as soon as the line is converted.
+    When the time budget runs out, the last object is { "error": ... }.
+    """
     in_str = request.form['str']
     sanskrit_mode, anusvara_style = _get_sanskrit_options()
-    seg = segmentbyone(in_str)
-    res = { "segmented" : seg }
-    add_phono(seg, res, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style)
-    return json.dumps(res, ensure_ascii=False)
+    try:
+        schemas = _parse_schemas(request.form.get('schemas'))
+    except ValueError as e:
+        return _json_error(str(e))
+    limits.check_texts([in_str])
+    def generate():
+        lines = iter_convert(in_str, mode, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+        with limits.budget():
+            try:
+                for res in lines:
+                    yield json.dumps(res, ensure_ascii=False) + "\n"
+            except limits.BudgetExceeded as e:
+                yield json.dumps({ "error" : str(e) }, ensure_ascii=False) + "\n"
+    return Response(generate(), mimetype='application/x-ndjson')
+
+def _json_response(res, status=200):
+    return json.dumps(res, ensure_ascii=False), status, {'Content-Type': 'application/json'}
+
+def _json_error(message, status=400):
+    return _json_response({ "error" : message }, status)
+
+def _accepted_encodings():
+    """The encodings of assets.ENCODINGS the client takes, in order of preference."""
+    return [encoding for encoding in assets.available_encodings() if request.accept_encodings[encoding]]
+
+@api.after_request
+def compress_response(response):
+    """Compress the conversion results (files and streams are left alone)."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSED_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encodings = _accepted_encodings()
+    data = response.get_data()
+    if not encodings or len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(assets.compress(data, encodings[0]))
+    response.headers['Content-Encoding'] = encodings[0]
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def _send_asset(name, immutable):
+    path, encoding = assets.variant(assets.ASSETS_DIR, name, _accepted_encodings())
+    response = send_from_directory(assets.ASSETS_DIR, path, mimetype=mimetypes.guess_type(name)[0],
+                                   download_name=os.path.basename(name), max_age=31536000 if immutable else 0)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@api.errorhandler(limits.LimitExceeded)
+def limit_exceeded(e):
+    return _json_error(str(e), e.status)
+
+@api.route('/segmentbywords', methods=['POST'])
+def segment_and_phon():
+    return _convert_form('words')
+
+@api.route('/segmentbyone', methods=['POST'])
+def segmentbyone_and_phon():
+    return _convert_form('one')
 
 @api.route('/segmentbytwo', methods=['POST'])
 def segmentbytwo_and_phon():
-    in_str = request.form['str']
-    sanskrit_mode, anusvara_style = _get_sanskrit_options()
-    seg = segmentbytwo(in_str)
-    res = { "segmented" : seg }
-    add_phono(seg, res, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style)
-    return json.dumps(res, ensure_ascii=False)
+    return _convert_form('two')
 
 @api.route('/phoneticize', methods=['POST'])
 def phon():
-    in_str = request.form['str']
-    sanskrit_mode, anusvara_style = _get_sanskrit_options()
-    res = {}
-    add_phono(in_str, res, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style)
-    return json.dumps(res, ensure_ascii=False)
+    return _convert_form('none')
+
+@api.route('/segmentbywords/stream', methods=['POST'])
+def segment_and_phon_stream():
+    return _stream_form('words')
+
+@api.route('/segmentbyone/stream', methods=['POST'])
+def segmentbyone_and_phon_stream():
+    return _stream_form('one')
+
+@api.route('/segmentbytwo/stream', methods=['POST'])
+def segmentbytwo_and_phon_stream():
+    return _stream_form('two')
+
+@api.route('/phoneticize/stream', methods=['POST'])
+def phon_stream():
+    return _stream_form('none')
+
+@api.route('/batch', methods=['POST'])
+def batch():
+    """
+    Convert many texts in one request. Body (JSON):
+        { "items": [ { "str": ..., "mode": "words"|"two"|"one"|"none",
+                       "sanskrit_mode": ..., "anusvara_style": ...,
+                       "schemas": ["kvp", "ipa"] }, ... ] }
+    "mode" defaults to "words" ("none" is the same as /phoneticize), "schemas" to all.
+    With "timing": true (and KVP_METRICS=1) the stage durations are added as "timing".
+    Returns { "results": [...] } in the order of the items, each result being
+    what the corresponding single route returns. Identical items are converted once,
+    and the words shared by items with the same options are phoneticized once.
+    Responses are cached and revalidated like the single routes' (see _cached_response).
+    """
+    body = request.get_json(silent=True)
+    items = body.get('items') if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        return _json_error('expected a JSON object with an "items" array')
+    keys = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('str'), str):
+            return _json_error(f'item {i}: "str" is required')
+        try:
+            keys.append((item['str'], *_json_options(item)))
+        except ValueError as e:
+            return _json_error(f'item {i}: {e}')
+    limits.check_texts(dict.fromkeys(key[0] for key in keys))
+    # Items sharing their options are converted together, so their common words are phoneticized once
+    groups = {}
+    for key in dict.fromkeys(keys):
+        groups.setdefault(key[1:], []).append(key[0])
+    def compute(timed=False):
+        converted = {}
+        with metrics.collect() as timings, limits.budget():
+            for (mode, sanskrit_mode, anusvara_style, schemas), in_strs in groups.items():
+                results = convert_many(in_strs, mode, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+                for in_str, res in zip(in_strs, results):
+                    converted[(in_str, mode, sanskrit_mode, anusvara_style, schemas)] = res
+        res = { "results" : [converted[key] for key in keys] }
+        if timed:
+            res["timing"] = _timing_ms(timings)
+        return json.dumps(res, ensure_ascii=False)
+    if _wants_timing(body.get('timing')):
+        return compute(timed=True), 200, {'Content-Type': 'application/json'}
+    return _cached_response('batch', keys, compute, {'Content-Type': 'application/json'})
+
+@api.route('/incremental', methods=['POST'])
+def incremental():
+    """
+    Line-level conversion for the live editor (see incremental.py). Body (JSON):
+        { "mode": ..., "sanskrit_mode": ..., "anusvara_style": ..., "schemas": ...,
+          "lines": [ { "hash": <sha1 of the line>, "str": <line> }, ... ] }
+    Only lines the client has no result for need to be sent; "str" can be
+    left out for lines the server already converted.
+    Returns { "results": { hash: line result }, "missing": [hashes to resend with their text] }.
+    """
+    body = request.get_json(silent=True)
+    lines = body.get('lines') if isinstance(body, dict) else None
+    if not isinstance(lines, list):
+        return _json_error('expected a JSON object with a "lines" array')
+    for i, entry in enumerate(lines):
+        if not isinstance(entry, dict) or not isinstance(entry.get('str', entry.get('hash')), str):
+            return _json_error(f'line {i}: "hash" or "str" is required')
+        if not all(isinstance(entry.get(field), (str, type(None))) for field in ('hash', 'str')):
+            return _json_error(f'line {i}: "hash" and "str" must be strings')
+    try:
+        mode, sanskrit_mode, anusvara_style, schemas = _json_options(body)
+    except ValueError as e:
+        return _json_error(str(e))
+    limits.check_texts([entry['str'] for entry in lines if isinstance(entry.get('str'), str)])
+    with metrics.collect() as timings, limits.budget():
+        results, missing = convert_lines(lines, mode, sanskrit_mode=sanskrit_mode, anusvara_style=anusvara_style, schemas=schemas)
+    res = { "results" : results, "missing" : missing }
+    if _wants_timing(body.get('timing')):
+        res["timing"] = _timing_ms(timings)
+    return _json_response(res)
+
+@api.route('/result/<key>', methods=['GET'])
+def cached_result(key):
+    """
+    A response of the conversion routes by its content key (their ETag and
+    Content-Location), for a caching proxy to keep: the key changes with the
+    input, options and data version, so the body never does. 404 once the
+    response has left RESPONSE_CACHE, the client then sends its request again.
+    """
+    headers = { 'ETag' : f'"{key}"', 'Cache-Control' : 'public, max-age=31536000, immutable' }
+    body = RESPONSE_CACHE.get(key)
+    if body is None:
+        return _json_error('unknown or expired result, send the conversion request again', 404)
+    if request.if_none_match.contains_weak(key):
+        return '', 304, headers
+    return body, 200, dict(headers, **{ 'Content-Type' : 'application/json' })
+
+@api.route('/metrics', methods=['GET'])
+def metrics_route():
+    """
+    Stage timings and counters (recorded while KVP_METRICS=1) and cache
+    statistics, in the Prometheus text format.
+    """
+    caches = { "phon" : PHON_CACHE.stats(), "line" : LINE_CACHE.stats(), "response" : RESPONSE_CACHE.stats() }
+    persistent = persistent_cache_stats()
+    if persistent is not None:
+        caches["persistent"] = persistent
+    lex = lexicon_stats()
+    if lex is not None:
+        caches["lexicon"] = lex
+    return metrics.render_prometheus(caches), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@api.route('/assets/<path:name>', methods=['GET'])
+def asset(name):
+    """The files of web/ by their hashed names (see assets.py), cached for good by browsers."""
+    return _send_asset(name, immutable=True)
 
 @api.route('/', methods=['GET'])
 def default():
-    return api.send_static_file('index.html')
+    if 'index.html' not in ASSETS:
+        return api.send_static_file('index.html')
+    # Revalidated on each visit, it names the current versions of the other files
+    return _send_asset(ASSETS['index.html'], immutable=False)
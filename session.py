@@ -0,0 +1,101 @@
+"""
+Live-editing sessions (the /session WebSocket of asgi.py).
+
+A Session holds what an editor connection has sent so far: its options and
+the lines of its text, edited message by message, and the results of the
+lines it converted, so only new or changed lines are converted again. Lines
+are converted as by /incremental (see incremental.py) and the results put
+together like the editor does with those of /incremental.
+
+Messages are JSON objects with a "seq" number, any options to change
+("mode", "sanskrit_mode", "anusvara_style", "schemas", kept until changed)
+and the text, either whole ("str") or as a line edit ("splice": [index of
+the first line, number of lines removed, [lines inserted]]). Each message
+gets one reply with its "seq": the fields of the conversion, { "error": ... },
+or { "superseded": true } when a later message arrived before its result
+was ready (its conversion is dropped or stopped).
+"""
+import limits
+from incremental import convert_line
+from phonetics import SEGMENTERS, SCHEMAS
+
+MODES = set(SEGMENTERS) | {'none'}
+
+class Session:
+    def __init__(self):
+        self.options = { "mode" : "words", "sanskrit_mode" : None, "anusvara_style" : "ṃ", "schemas" : None }
+        self.lines = [""]
+        # Line -> result, for the current options
+        self.results = {}
+
+    def update(self, message):
+        """Apply the options and text of a message, raising ValueError (or limits.LimitExceeded) for invalid ones."""
+        options = dict(self.options)
+        for name in options:
+            if name in message:
+                options[name] = message[name]
+        if not isinstance(options["mode"], str) or options["mode"] not in MODES:
+            raise ValueError(f'unknown mode "{options["mode"]}"')
+        if options["sanskrit_mode"] is not None and not isinstance(options["sanskrit_mode"], str):
+            raise ValueError('"sanskrit_mode" must be a string')
+        if not isinstance(options["anusvara_style"], str):
+            raise ValueError('"anusvara_style" must be a string')
+        schemas = message.get("schemas")
+        if schemas is not None:
+            if not isinstance(schemas, list) or not all(schema in SCHEMAS for schema in schemas):
+                raise ValueError(f'"schemas" must be a list of {", ".join(SCHEMAS)}')
+            options["schemas"] = tuple(schemas)
+        lines = self.lines
+        if "str" in message:
+            if not isinstance(message["str"], str):
+                raise ValueError('"str" must be a string')
+            lines = message["str"].split("\n")
+        elif "splice" in message:
+            lines = _splice(lines, message["splice"])
+        limits.check_texts(["\n".join(lines)])
+        if options != self.options:
+            self.options = options
+            self.results = {}
+        elif len(self.results) > 2 * len(lines) + 100:
+            # Forget the lines that were edited away
+            self.results = { line : self.results[line] for line in lines if line in self.results }
+        self.lines = lines
+
+    def snapshot(self):
+        """What run() converts: the current lines and options, and the results to reuse and fill."""
+        return tuple(self.lines), dict(self.options), self.results
+
+    def run(self, snapshot, cancel):
+        """
+        Convert a snapshot, unless the threading.Event cancel is set first.
+        Returns the reply fields: the conversion's, { "superseded": True }
+        or { "error": ... }.
+        """
+        lines, options, results = snapshot
+        line_results = []
+        try:
+            with limits.budget(), limits.cancel_on(cancel):
+                for line in lines:
+                    res = results.get(line)
+                    if res is None:
+                        limits.check()
+                        res = results[line] = convert_line(line, options["mode"], options["sanskrit_mode"], options["anusvara_style"], options["schemas"])
+                    line_results.append(res)
+        except limits.Cancelled:
+            return { "superseded" : True }
+        except limits.LimitExceeded as e:
+            return { "error" : str(e) }
+        schemas = options["schemas"] or list(SCHEMAS)
+        reply = { schema : "".join(res[schema] + "\n" for res in line_results) for schema in schemas }
+        if options["mode"] != 'none':
+            reply["segmented"] = "\n".join(res["segmented"] for res in line_results)
+        return reply
+
+def _splice(lines, splice):
+    if not (isinstance(splice, list) and len(splice) == 3 and all(isinstance(n, int) and n >= 0 for n in splice[:2])
+            and isinstance(splice[2], list) and all(isinstance(line, str) for line in splice[2])):
+        raise ValueError('"splice" must be [start, delete count, [lines]]')
+    start, count, inserted = splice
+    if start + count > len(lines):
+        raise ValueError(f'"splice" goes past the {len(lines)} lines of the text')
+    return lines[:start] + inserted + lines[start + count:]
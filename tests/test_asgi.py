@@ -0,0 +1,175 @@
+import asyncio
+import json
+import sys
+import os
+import threading
+import time
+import urllib.parse
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from asgi import ASGIApp, Lane, app
+from phonetics import convert
+
+def _request(asgi_app, path, body=b'', method='POST', content_type='application/x-www-form-urlencoded'):
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+        'headers': [(b'content-type', content_type.encode())],
+    }
+    messages = [{ 'type': 'http.request', 'body': body, 'more_body': False }]
+    sent = []
+    async def receive():
+        return messages.pop(0)
+    async def send(message):
+        sent.append(message)
+    asyncio.run(asgi_app(scope, receive, send))
+    headers = dict(sent[0]['headers'])
+    return sent[0]['status'], headers, b''.join(m.get('body', b'') for m in sent[1:])
+
+def _form(**fields):
+    return urllib.parse.urlencode(fields).encode()
+
+def test_asgi_serves_flask_routes():
+    status, headers, body = _request(app, '/segmentbytwo', _form(str="ཇི་སྙེད་དོན་ཀུན་"))
+    assert status == 200
+    assert json.loads(body) == convert("ཇི་སྙེད་དོན་ཀུན་", "two")
+    status, headers, body = _request(app, '/batch', json.dumps({ "items": [{ "str": "ཇི་སྙེད་" }] }).encode(), content_type='application/json')
+    assert status == 200
+    assert json.loads(body)["results"] == [convert("ཇི་སྙེད་")]
+
+def test_long_inputs_go_to_long_lane():
+    assert app.lane_for(b'x' * 100) is app.short_lane
+    assert app.lane_for(b'x' * (app.short_max_bytes + 1)) is app.long_lane
+
+def _blocking_app(release, started=None):
+    def wsgi_app(environ, start_response):
+        if started is not None:
+            started.set()
+        release.wait(5)
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'done']
+    return wsgi_app
+
+def test_full_lane_returns_429_with_retry_after():
+    release = threading.Event()
+    started = threading.Event()
+    lane = Lane('short', workers=1, max_queue=0, max_wait=5)
+    asgi_app = ASGIApp(_blocking_app(release, started), lane, Lane('long', 1, 0, 5))
+    first = threading.Thread(target=_request, args=(asgi_app, '/'))
+    first.start()
+    # The first request holds the lane's only worker
+    assert started.wait(5)
+    status, headers, body = _request(asgi_app, '/')
+    release.set()
+    first.join()
+    assert status == 429
+    assert int(headers[b'retry-after']) >= 1
+    assert "error" in json.loads(body)
+
+class _QueueWatchingLane(Lane):
+    """A Lane setting `queued` once a job has to wait for a worker."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.queued = threading.Event()
+
+    def _acquire(self):
+        acquired = super()._acquire()
+        if acquired and self.stats()["pending"] > self.workers:
+            self.queued.set()
+        return acquired
+
+def test_request_queued_too_long_returns_503():
+    release = threading.Event()
+    started = threading.Event()
+    lane = _QueueWatchingLane('short', 1, 1, 0.05)
+    asgi_app = ASGIApp(_blocking_app(release, started), lane, Lane('long', 1, 0, 5))
+    first = threading.Thread(target=_request, args=(asgi_app, '/'))
+    first.start()
+    # The first request holds the lane's only worker
+    assert started.wait(5)
+    def release_after_max_wait():
+        # Free the worker once the second request has waited longer than max_wait
+        if lane.queued.wait(5):
+            time.sleep(lane.max_wait * 2)
+        release.set()
+    threading.Thread(target=release_after_max_wait).start()
+    status, headers, body = _request(asgi_app, '/')
+    first.join()
+    assert status == 503
+    assert b'retry-after' in headers
+
+def test_streamed_response_is_sent_in_parts():
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/segmentbyone/stream', 'query_string': b'',
+        'headers': [(b'content-type', b'application/x-www-form-urlencoded')],
+    }
+    messages = [{ 'type': 'http.request', 'body': _form(str="ཇི་སྙེད་\nདོན་ཀུན་"), 'more_body': False }]
+    sent = []
+    async def receive():
+        return messages.pop(0)
+    async def send(message):
+        sent.append(message)
+    asyncio.run(app(scope, receive, send))
+    assert sent[0]['status'] == 200
+    bodies = [m['body'] for m in sent[1:] if m['body']]
+    assert len(bodies) == 2
+    assert [json.loads(body)["segmented"] for body in bodies] == ["ཇི་ སྙེད་ ", "དོན་ ཀུན་ "]
+
+def _session(messages):
+    """Send messages on a /session WebSocket, returning the replies once the last one is answered."""
+    replies = []
+    async def run():
+        incoming = asyncio.Queue()
+        for message in [{ 'type': 'websocket.connect' }] + [{ 'type': 'websocket.receive', 'text': json.dumps(m) } for m in messages]:
+            incoming.put_nowait(message)
+        async def send(message):
+            if message['type'] == 'websocket.send':
+                replies.append(json.loads(message['text']))
+                if replies[-1]['seq'] == messages[-1]['seq']:
+                    incoming.put_nowait({ 'type': 'websocket.disconnect' })
+        await app({ 'type': 'websocket', 'path': '/session', 'headers': [] }, incoming.get, send)
+    asyncio.run(run())
+    return replies
+
+def test_session_converts_latest_edit_only():
+    text = "ཇི་སྙེད་དོན་ཀུན་\nཇི་བཞིན་གཟིགས་ཕྱིར་"
+    replies = _session([
+        { "seq": 1, "str": "ཇི་སྙེད་", "mode": "one", "schemas": ["kvp"] },
+        { "seq": 2, "str": "ཇི་སྙེད་དོན་" },
+        { "seq": 3, "str": text },
+    ])
+    assert replies[:2] == [{ "seq": 1, "superseded": True }, { "seq": 2, "superseded": True }]
+    # Put together from the line results, like the editor does with /incremental
+    from incremental import convert_line
+    lines = [convert_line(line, "one", schemas=("kvp",)) for line in text.split("\n")]
+    assert replies[2] == { "seq": 3, "kvp": "".join(res["kvp"] + "\n" for res in lines), "segmented": "\n".join(res["segmented"] for res in lines) }
+
+def test_session_applies_splices_and_reports_errors():
+    from session import Session
+    session = Session()
+    session.update({ "str": "ཇི་སྙེད་\nདོན་ཀུན་", "mode": "none" })
+    session.update({ "splice": [1, 1, ["ཇི་བཞིན་", "གཟིགས་ཕྱིར་"]] })
+    assert session.lines == ["ཇི་སྙེད་", "ཇི་བཞིན་", "གཟིགས་ཕྱིར་"]
+    assert session.run(session.snapshot(), threading.Event())["kvp"] == convert("\n".join(session.lines), "none")["kvp"]
+    cancelled = threading.Event()
+    cancelled.set()
+    session.update({ "str": "དོན་ཀུན་" })
+    assert session.run(session.snapshot(), cancelled) == { "superseded": True }
+    replies = _session([{ "seq": 1, "splice": [5, 0, []] }, { "seq": 2, "mode": "three" }])
+    assert [set(reply) for reply in replies] == [{ "seq", "error" }, { "seq", "error" }]
+
+def test_session_answers_invalid_options_with_errors(monkeypatch):
+    replies = _session([
+        { "seq": 1, "str": "ཇི་སྙེད་", "mode": ["one"] },
+        { "seq": 2, "str": "ཇི་སྙེད་", "sanskrit_mode": { "iast": 1 } },
+        { "seq": 3, "str": "ཇི་སྙེད་", "anusvara_style": 1 },
+        { "seq": 4, "str": "ཇི་སྙེད་", "mode": "one" },
+    ])
+    assert [set(reply) for reply in replies[:3]] == [{ "seq", "error" }] * 3
+    assert replies[3]["segmented"] == "ཇི་ སྙེད་ "
+    # A conversion failing unexpectedly is answered too
+    from session import Session
+    def fail(self, snapshot, cancel):
+        raise RuntimeError("broken")
+    monkeypatch.setattr(Session, "run", fail)
+    assert _session([{ "seq": 1, "str": "ཇི་སྙེད་" }]) == [{ "seq": 1, "error": "RuntimeError: broken" }]
@@ -0,0 +1,105 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from cache import LRUCache
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 3, "misses": 1, "evictions": 1}
+
+def test_lru_get_or_compute_only_computes_misses():
+    cache = LRUCache(10)
+    calls = []
+    compute = lambda: calls.append(1) or "kar"
+    assert cache.get_or_compute("དཀར", compute) == "kar"
+    assert cache.get_or_compute("དཀར", compute) == "kar"
+    assert len(calls) == 1
+
+def test_lru_resize_and_disable():
+    cache = LRUCache(3)
+    for key in "abc":
+        cache.put(key, key)
+    cache.resize(1)
+    assert len(cache) == 1 and cache.get("c") == "c"
+    cache.resize(0)
+    cache.put("d", "d")
+    assert len(cache) == 0
+
+def test_lru_bounds_total_weight():
+    cache = LRUCache(10, maxweight=5, weight=len)
+    cache.put("a", "xx")
+    cache.put("b", "xx")
+    cache.put("c", "xx")
+    assert cache.get("a") is None and cache.get("c") == "xx"
+    assert cache.stats()["weight"] == 4
+    cache.put("b", "x")
+    assert cache.stats()["weight"] == 3
+    # Heavier than the whole cache: not stored, nothing evicted
+    cache.put("d", "xxxxxx")
+    assert cache.get("d") is None and len(cache) == 2
+
+def test_phon_cache_reuses_converter_output():
+    from phonetics import add_phono, phon_cache_stats, PHON_CACHE
+    PHON_CACHE.clear()
+    res = {}
+    add_phono("བློ་གྲོས་ བློ་གྲོས་ བློ་གྲོས་", res)
+    assert len(set(res["kvp"].split())) == 1
+    add_phono("བློ་གྲོས་", {})
+    stats = phon_cache_stats()
+    # Repeated words of a text are converted once: one miss per converter,
+    # then one hit per converter for the second text
+    assert stats["misses"] == 2
+    assert stats["hits"] == 2
+
+def test_convert_many_matches_convert():
+    from phonetics import convert, convert_many
+    texts = ["ཇི་སྙེད་དོན་ཀུན་\nཇི་སྙེད་", "ཨོཾ་ཨཱཿཧཱུྃ་ཇི་སྙེད་", ""]
+    for mode in ("words", "one", "none"):
+        assert convert_many(texts, mode, sanskrit_mode="iast") == [convert(text, mode, sanskrit_mode="iast") for text in texts]
+
+def test_persistent_cache_keeps_entries_of_its_version(tmp_path):
+    from cache import PersistentCache
+    path = str(tmp_path / "results.sqlite")
+    cache = PersistentCache(path, "v1")
+    cache.put_many([("a", "1"), ("b", "2")])
+    assert cache.get_many(["a", "b", "c"]) == { "a": "1", "b": "2" }
+    assert PersistentCache(path, "v1").get("a") == "1"
+    # Another data version doesn't see them, nor drop them until asked to
+    other = PersistentCache(path, "v2")
+    assert other.get("a") is None
+    assert cache.get("a") == "1"
+    assert other.drop_other_versions() == 2
+    assert cache.stats()["size"] == 0
+
+def test_persistent_cache_drops_oldest_entries(tmp_path):
+    from cache import PersistentCache
+    path = str(tmp_path / "results.sqlite")
+    cache = PersistentCache(path, "v1", max_rows=10)
+    PersistentCache(path, "v0").put("old", "0")
+    for i in range(10):
+        cache.put(f"k{i}", str(i))
+    stats = cache.stats()
+    assert stats["size"] <= 10 and stats["evictions"] > 0
+    assert PersistentCache(path, "v0").get("old") is None
+    assert cache.get("k9") == "9"
+
+def test_conversions_use_persistent_cache(tmp_path, monkeypatch):
+    import phonetics
+    from cache import PersistentCache
+    persistent = PersistentCache(str(tmp_path / "results.sqlite"), phonetics._data_version())
+    monkeypatch.setattr(phonetics, "_PERSISTENT_CACHE", persistent)
+    text = "ཇི་སྙེད་དོན་ཀུན་\nཨོཾ་ཨཱཿཧཱུྃ་"
+    first = phonetics.convert(text, sanskrit_mode="iast")
+    assert persistent.stats()["hits"] == 0
+    assert phonetics.convert(text, sanskrit_mode="iast") == first
+    stats = persistent.stats()
+    assert stats["hits"] == stats["misses"]
+    assert phonetics.convert(text, "one") == phonetics.convert(text, "one")
@@ -0,0 +1,60 @@
+import json
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import cli
+from phonetics import convert
+
+def test_cli_converts_jsonl(tmp_path):
+    source = tmp_path / "in.jsonl"
+    output = tmp_path / "out.jsonl"
+    source.write_text(
+        json.dumps({ "id": "a", "str": "ཇི་སྙེད་དོན་ཀུན་" }, ensure_ascii=False) + "\n" +
+        json.dumps({ "str": "ཨོཾ་ཨཱཿཧཱུྃ་", "sanskrit_mode": "phonetics" }, ensure_ascii=False) + "\n",
+        encoding="utf-8")
+    assert cli.main([str(source), "-o", str(output), "--jobs", "1", "--mode", "two"]) == 0
+    results = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert results[0] == dict(convert("ཇི་སྙེད་དོན་ཀུན་", "two"), id="a")
+    assert results[1] == dict(convert("ཨོཾ་ཨཱཿཧཱུྃ་", "two", sanskrit_mode="phonetics"), id=2)
+
+def test_cli_writes_files_for_directory(tmp_path):
+    (tmp_path / "in" / "vol1").mkdir(parents=True)
+    (tmp_path / "in" / "vol1" / "text.txt").write_text("ཇི་སྙེད་དོན་ཀུན་", encoding="utf-8")
+    assert cli.main([str(tmp_path / "in"), "--output-dir", str(tmp_path / "out"), "--jobs", "2", "--mode", "one"]) == 0
+    res = convert("ཇི་སྙེད་དོན་ཀུན་", "one")
+    for key in ("segmented", "kvp", "ipa"):
+        assert (tmp_path / "out" / "vol1" / f"text.{key}.txt").read_text(encoding="utf-8") == res[key]
+
+def test_cli_chunk_with_mixed_options(tmp_path):
+    source = tmp_path / "in.jsonl"
+    output = tmp_path / "out.jsonl"
+    docs = [
+        { "id": 1, "str": "ཇི་སྙེད་དོན་ཀུན་" },
+        { "id": 2, "str": "ཇི་སྙེད་", "mode": "one" },
+        { "id": 3, "str": "དོན་ཀུན་ཇི་སྙེད་" },
+    ]
+    source.write_text("".join(json.dumps(doc, ensure_ascii=False) + "\n" for doc in docs), encoding="utf-8")
+    assert cli.main([str(source), "-o", str(output), "--jobs", "1", "--chunksize", "3"]) == 0
+    results = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert results == [dict(convert(doc["str"], doc.get("mode", "words")), id=doc["id"]) for doc in docs]
+
+def test_cli_reports_bad_records_and_converts_the_others(tmp_path, capsys):
+    source = tmp_path / "in.jsonl"
+    output = tmp_path / "out.jsonl"
+    source.write_text("{not json\n" + json.dumps({ "id": "x" }) + "\n" + json.dumps({ "id": "a", "str": "ཇི་སྙེད་" }, ensure_ascii=False) + "\n", encoding="utf-8")
+    assert cli.main([str(source), "-o", str(output), "--jobs", "1"]) == 1
+    results = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert results[0]["id"] == 1 and results[0]["error"].startswith("line 1: invalid JSON")
+    assert results[1] == { "id": "x", "error": 'line 2: "str" is required' }
+    assert results[2] == dict(convert("ཇི་སྙེད་"), id="a")
+    assert "line 1" in capsys.readouterr().err
+
+def test_cli_keeps_output_files_inside_output_dir(tmp_path):
+    source = tmp_path / "in.jsonl"
+    docs = [{ "id": "../escaped", "str": "ཇི་སྙེད་" }, { "id": "/tmp/absolute", "str": "ཇི་སྙེད་" }, { "id": "vol/ok", "str": "ཇི་སྙེད་" }]
+    source.write_text("".join(json.dumps(doc, ensure_ascii=False) + "\n" for doc in docs), encoding="utf-8")
+    assert cli.main([str(source), "--output-dir", str(tmp_path / "out"), "--jobs", "1"]) == 1
+    assert not (tmp_path / "escaped.kvp.txt").exists()
+    assert not os.path.exists("/tmp/absolute.kvp.txt")
+    assert (tmp_path / "out" / "vol" / "ok.kvp.txt").exists()
@@ -0,0 +1,55 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+
+import lexicon
+import phonetics
+
+COLUMNS = [("KVP", (("unknownSyllableMarker", True),)), ("MST", ())]
+
+def test_lexicon_lookups(tmp_path):
+    path = str(tmp_path / "lexicon.bin")
+    entries = { "བློ་གྲོས་" : ["lodrö", "lø˥˥.ʈʰø˥˥"], "སངས་རྒྱས་" : ["sangyé", "sáŋ.ɟɛ̀"], "ཀ་" : ["ka", ""] }
+    lexicon.write(path, entries, COLUMNS, "1.0")
+    lex = lexicon.Lexicon(path)
+    assert len(lex) == 3 and sorted(lex.words()) == sorted(entries)
+    for word, outputs in entries.items():
+        assert [lex.get(column, word) for column in COLUMNS] == outputs
+    assert lex.get(COLUMNS[0], "བློ་") is None
+    # A converter set up differently doesn't use the file
+    assert lex.get(("KVP", ()), "ཀ་") is None
+    assert lex.header["bophono"] == "1.0"
+    assert lex.stats()["hits"] == 6 and lex.stats()["misses"] == 1
+
+def test_empty_lexicon_and_invalid_file(tmp_path):
+    path = str(tmp_path / "lexicon.bin")
+    lexicon.write(path, {}, COLUMNS)
+    assert lexicon.Lexicon(path).get(COLUMNS[0], "ཀ་") is None
+    (tmp_path / "other.bin").write_bytes(b"not a lexicon")
+    with pytest.raises(ValueError):
+        lexicon.Lexicon(str(tmp_path / "other.bin"))
+
+def test_conversions_use_lexicon_first(tmp_path, monkeypatch):
+    text = "བློ་གྲོས་ཀྱི་སངས་རྒྱས་\nཨོཾ་ཨཱཿཧཱུྃ་བློ་གྲོས་"
+    expected = phonetics.convert(text, sanskrit_mode="iast")
+    path = str(tmp_path / "lexicon.bin")
+    lexicon.build(path, ["བློ་གྲོས་", "སངས་རྒྱས་", "ཀྱི་", "ཨོཾ་ཨཱཿཧཱུྃ་བློ་གྲོས་"])
+    lex = lexicon.Lexicon(path)
+    assert "བློ་གྲོས་" in set(lex.words())
+    monkeypatch.setattr(phonetics, "_LEXICON", lex)
+    phonetics.PHON_CACHE.clear()
+    assert phonetics.convert(text, sanskrit_mode="iast") == expected
+    assert lex.stats()["hits"] > 0
+    assert phonetics.phon_cache_stats()["misses"] < lex.stats()["hits"]
+
+def test_lexicon_of_another_bophono_version_is_ignored(tmp_path, monkeypatch):
+    path = str(tmp_path / "lexicon.bin")
+    lexicon.write(path, { "ཀ་" : ["ka", "ka"] }, COLUMNS, "0.0-old")
+    monkeypatch.setenv("KVP_LEXICON", path)
+    assert phonetics._open_lexicon() is False
+    lexicon.write(path, { "ཀ་" : ["ka", "ka"] }, COLUMNS, lexicon.bophono_version())
+    assert phonetics._open_lexicon().get(COLUMNS[0], "ཀ་") == "ka"
+    monkeypatch.setenv("KVP_LEXICON", "0")
+    assert phonetics._open_lexicon() is False
@@ -0,0 +1,53 @@
+import itertools
+import json
+import sys
+import os
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'benchmarks')))
+
+import loadtest
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert loadtest.percentile(values, 50) == 50
+    assert loadtest.percentile(values, 99) == 99
+    assert loadtest.percentile([7], 95) == 7
+    assert loadtest.percentile([], 50) is None
+
+def test_request_mix_depends_only_on_seed():
+    first = [next(loadtest.client_requests(3, 0)) for _ in range(1)]
+    requests = loadtest.client_requests(3, 0)
+    assert [next(requests) for _ in range(20)][:1] == first
+    assert list(zip(range(20), loadtest.client_requests(3, 0))) != list(zip(range(20), loadtest.client_requests(4, 0)))
+
+def test_cold_requests_are_all_different():
+    texts = [fields["str"] for client in range(3) for _, _, fields in itertools.islice(loadtest.client_requests(0, client, cold=True), 50)]
+    assert len(set(texts)) == len(texts)
+
+def _run(tmp_path, *args):
+    from werkzeug.serving import make_server
+    from server import api, RESPONSE_CACHE
+    RESPONSE_CACHE.clear()
+    server = make_server('127.0.0.1', 0, api, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        save = str(tmp_path / "run.json")
+        assert loadtest.main(["--url", f"http://127.0.0.1:{server.server_port}", "--duration", "0", "--save", save, *args]) == 0
+    finally:
+        server.shutdown()
+    with open(save) as f:
+        return json.load(f)
+
+def test_run_reports_each_route(tmp_path):
+    summary = _run(tmp_path, "--clients", "2", "--requests", "15")
+    assert summary["total"]["requests"] == 30
+    assert summary["total"]["error_rate"] == 0
+    assert set(summary["routes"]) <= set(loadtest.ROUTES.values())
+    assert summary["total"]["p50_ms"] <= summary["total"]["p99_ms"]
+    assert 0 <= summary["total"]["cache_hit_rate"] <= 1
+
+def test_cold_run_is_not_answered_from_cache(tmp_path):
+    summary = _run(tmp_path, "--clients", "1", "--requests", "10", "--cold")
+    assert summary["total"]["cache_hit_rate"] == 0
@@ -0,0 +1,59 @@
+import json
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import metrics
+from server import api
+from phonetics import convert
+
+@pytest.fixture
+def enabled():
+    metrics.reset()
+    metrics.enable()
+    yield
+    metrics.enable(False)
+    metrics.reset()
+
+def test_nothing_recorded_when_disabled():
+    metrics.reset()
+    convert("ཇི་སྙེད་དོན་ཀུན་", "one")
+    assert metrics.snapshot() == { "stages": {}, "counters": {} }
+
+def test_stages_and_counters_recorded(enabled):
+    convert("ཇི་སྙེད་དོན་ཀུན་\nཨོཾ་ཨཱཿཧཱུྃ་", "words", sanskrit_mode="iast")
+    data = metrics.snapshot()
+    for stage in ("normalize", "sanskrit", "clean_output"):
+        assert data["stages"][stage]["calls"] >= 1
+    assert data["counters"]["lines"] == 2
+    assert data["counters"]["words"] >= 2
+    assert data["counters"]["sanskrit_matches"] >= 1
+
+def test_collect_is_per_block(enabled):
+    with metrics.collect() as timings:
+        convert("ཇི་སྙེད་དོན་ཀུན་", "one")
+    assert "segmentbyone" in timings
+    metrics.observe("other", 1.0)
+    assert "other" not in timings
+
+def test_metrics_route(enabled):
+    convert("ཇི་སྙེད་དོན་ཀུན་", "two")
+    response = api.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain')
+    text = response.data.decode('utf-8')
+    assert 'kvp_metrics_enabled 1' in text
+    assert 'kvp_stage_calls_total{stage="segmentbytwo"} 1' in text
+    assert 'kvp_cache_hits_total{cache="phon"}' in text
+
+def test_timing_in_response(enabled):
+    client = api.test_client()
+    res = json.loads(client.post('/segmentbyone', data={ "str": "ཇི་སྙེད་", "timing": "1" }).data)
+    assert res["timing"]["segmentbyone"] >= 0
+    res = json.loads(client.post('/batch', json={ "items": [{ "str": "ཇི་སྙེད་" }], "timing": True }).data)
+    assert "timing" in res and "timing" not in res["results"][0]
+
+def test_no_timing_when_disabled():
+    res = json.loads(api.test_client().post('/segmentbyone', data={ "str": "ཇི་སྙེད་", "timing": "1" }).data)
+    assert "timing" not in res
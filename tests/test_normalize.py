@@ -0,0 +1,61 @@
+import random
+import re
+import sys
+import os
+import unicodedata
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from phonetics import _normalize_tibetan
+
+# The normalizer before it was made a single pass, kept as the reference
+def _normalize_tibetan_legacy(text):
+    """
+    Normalize Tibetan text (ported from tibetan-normalizer JS).
+    """
+    # Normalize Unicode
+    normalized = unicodedata.normalize('NFC', text)
+    
+    # Normalize combined letters
+    normalized = normalized.replace(' ', ' ')  # Non-breaking space
+    normalized = normalized.replace('ༀ', 'ཨོཾ')  # Om symbol
+    normalized = normalized.replace('ཀྵ', 'ཀྵ')
+    normalized = normalized.replace('བྷ', 'བྷ')
+    normalized = re.sub(r'ི+', 'ི', normalized)  # Multiple i vowels
+    normalized = re.sub(r'ུ+', 'ུ', normalized)  # Multiple u vowels
+    normalized = normalized.replace('ཱུ', 'ཱུ')
+    normalized = normalized.replace('ཱི', 'ཱི')
+    normalized = normalized.replace('ཱྀ', 'ཱྀ')
+    normalized = normalized.replace('དྷ', 'དྷ')
+    normalized = normalized.replace('གྷ', 'གྷ')
+    normalized = normalized.replace('ཪླ', 'རླ')
+    normalized = normalized.replace('ྡྷ', 'ྡྷ')
+    
+    # Normalize tsheks
+    # Malformed: anusvara before vowel - swap them
+    normalized = re.sub(r'(ཾ)([ཱེིོྀུ])', r'\2\1', normalized)
+    normalized = normalized.replace('༌', '་')  # Alternative tshek
+    normalized = re.sub(r'་+', '་', normalized)  # Multiple consecutive tsheks
+    
+    return normalized
+
+
+# Characters the normalization rules deal with, with composed letters NFC
+# decomposes or reorders, and some ordinary text
+_ALPHABET = ["ༀ", "ཾ", "ྃ", "ི", "ུ", "ཱ", "ེ", "ོ", "ྀ", "་", "༌", "ཪ", "ླ", "ར", "ཀ", "ྵ", "བ", "ྷ", "ཨ", "ད", "ྡ", "\u0f73", "\u0f75", "\u0f81", "\u0f69", "\u0f43", "\u0f77", " ", "\u00a0", "\n", "a"]
+
+def test_normalizer_matches_legacy_on_random_text():
+    rng = random.Random(0)
+    for _ in range(20000):
+        text = "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 12)))
+        assert _normalize_tibetan(text) == _normalize_tibetan_legacy(text), [hex(ord(c)) for c in text]
+
+def test_normalizer_matches_legacy_on_corpus():
+    corpus_dir = os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'corpus')
+    for name in sorted(os.listdir(corpus_dir)):
+        with open(os.path.join(corpus_dir, name), encoding="utf-8") as f:
+            text = f.read()
+        assert _normalize_tibetan(text) == _normalize_tibetan_legacy(text)
+
+def test_normalized_text_is_returned_as_is():
+    text = "ཇི་སྙེད་དོན་ཀུན་"
+    assert _normalize_tibetan(text) is text
@@ -0,0 +1,21 @@
+import io
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+import prefork
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="needs /proc/<pid>/smaps_rollup")
+def test_memory_usage_and_report():
+    usage = prefork.memory_usage(os.getpid())
+    assert usage["rss"] > 0
+    assert usage["rss"] == usage["shared"] + usage["private"]
+    out = io.StringIO()
+    prefork.report(os.getpid(), [os.getpid()], out)
+    lines = out.getvalue().splitlines()
+    assert lines[0].startswith("master") and lines[1].startswith("worker 0")
+    assert lines[-1].startswith("total pss")
+
+def test_memory_usage_of_missing_process():
+    assert prefork.memory_usage(-1) is None
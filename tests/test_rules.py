@@ -0,0 +1,62 @@
+import random
+import re
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rules import Rule, RuleSet
+from phonetics import _presegment, _postsegment, _clean_phono_output, _POSTSEGMENT_RULES
+
+# The chains of re.sub the rule sets replace, kept as the reference
+def _presegment_legacy(in_str):
+    in_str = re.sub(r"(^| )(མ)་", r" \2་ ", in_str)
+    return in_str
+
+def _postsegment_legacy(in_str):
+    # Combine particle with previous syllable when there is just one
+    in_str = re.sub(r"(^| )([^ ]+)[\u0F0B\u0F0C] +(མེད|བ|པ|བོ|ཝོ|མོ|བའི|བས|བའོ|པའི|པར|པས|པའོ|བོའི|བོར|བོས|བོའོ|པོའི|པོར|པོས|པོའོ|མའི|མས|མའོ|མོའི|མོར|མོའོ)($|[ ་-༔])", r"\1\2་\3\4", in_str)
+    in_str = re.sub(r"([\u0F40-\u0FBC]) +([\u0F40-\u0FBC])", r"\1\2", in_str)
+    # Make sure imperative endings are separate (chik, shok)
+    in_str = re.sub(r"(གཅིག|ཅིག|ཞིག|ཤིགས|ཤིག|ཞོགས|ཤོགས|ཤོག|ཞོག)($|[ ་-༔])", r" \1\2", in_str)
+    return in_str
+
+def _clean_phono_output_legacy(phon_str):
+    """Clean up phonetic output: merge consecutive (?) markers and trim spaces"""
+    # Merge consecutive (?) markers (with optional spaces between), keep one trailing space
+    phon_str = re.sub(r'\(\?\)(\s*\(\?\))+', '(?)', phon_str)
+    # Collapse multiple spaces into one
+    phon_str = re.sub(r'  +', ' ', phon_str)
+    # Remove trailing space before newline or end
+    phon_str = re.sub(r' +(\n|$)', r'\1', phon_str)
+    return phon_str
+
+_SEGMENT_PIECES = ["མ་", "ཀ་", "ཁ", "པ", "བ", "པོ", "མེད", "བའི", "ཅིག", "གཅིག", "ཤོགས", "ཞིག", "་", "༌", "།", " ", "  "]
+_PHONO_PIECES = ["(?)", "(?", ")", " ", "  ", "\n", "ka", "é"]
+
+def _random_texts(pieces, count=20000):
+    rng = random.Random(0)
+    for _ in range(count):
+        yield "".join(rng.choice(pieces) for _ in range(rng.randint(0, 10)))
+
+def test_segment_rules_match_legacy():
+    for text in _random_texts(_SEGMENT_PIECES):
+        assert _presegment(text) == _presegment_legacy(text)
+        assert _postsegment(text) == _postsegment_legacy(text)
+        assert _POSTSEGMENT_RULES.would_change(text) == (_postsegment_legacy(text) != text)
+
+def test_clean_phono_output_matches_legacy():
+    for text in _random_texts(_PHONO_PIECES):
+        assert _clean_phono_output(text) == _clean_phono_output_legacy(text), repr(text)
+
+def test_rule_triggers_skip_the_regex():
+    rule = Rule(r"b+", "b", triggers=["bb"])
+    assert not rule.could_apply("abab")
+    assert rule.apply("abab") == "abab"
+    assert rule.apply("abba") == "aba"
+
+def test_would_change_sees_later_rules_undoing_a_change():
+    rules = RuleSet(Rule(r"a", "b"), Rule(r"b", "a"))
+    assert rules.apply("a") == "a"
+    assert not rules.would_change("a")
+    assert rules.would_change("ab")
+    assert not rules.would_change("c")
@@ -55,3 +55,43 @@ def test_anusvara_style(tibetan, expected_m_under, expected_m_over):
     res = {}
     add_phono(segmentbywords(tibetan), res, sanskrit_mode='iast', anusvara_style='ṁ')
     assert expected_m_over in res['kvp'], f"Expected {expected_m_over} with ṁ style, got {res['kvp']}"
+
+@pytest.mark.parametrize("tibetan, expected_keep, expected_iast, expected_phonetics", sanskrit_cases)
+def test_sanskrit_index_matches_pattern_loop(tibetan, expected_keep, expected_iast, expected_phonetics):
+    """The compiled Sanskrit index finds the same matches as scanning every pattern"""
+    from phonetics import _SANSKRIT_PATTERNS, _find_sanskrit_matches
+
+    matches = []
+    for compiled_pattern, _, transliteration, phonetics in _SANSKRIT_PATTERNS:
+        for match in compiled_pattern.finditer(tibetan):
+            matches.append((match.start(), match.end(), transliteration, phonetics))
+    matches.sort(key=lambda x: (x[0], -(x[1] - x[0])))
+    expected = []
+    last_end = 0
+    for match in matches:
+        if match[0] >= last_end:
+            expected.append(match)
+            last_end = match[1]
+
+    assert _find_sanskrit_matches(tibetan) == expected
+
+def test_backtracking_prone_patterns_are_detected():
+    from phonetics import _backtracking_groups
+    assert _backtracking_groups("(ཝ|བ)ནྟི་?ཡེ་") == []
+    assert _backtracking_groups("[(]+ཨ[ཱ]?") == []
+    # Branches that can't both match don't backtrack
+    assert _backtracking_groups("(?:ཨ|ཧ)+ཾ") == []
+    assert _backtracking_groups("(ཨ+)+ཧཾ") == [(0, 5)]
+    assert _backtracking_groups("ཀ(ཨ|ཨཧ)*ཾ") == [(1, 8)]
+
+def test_sanskrit_patterns_match_like_their_entries():
+    import re
+    from phonetics import _resource
+    with open(os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'corpus', 'mantra.txt'), encoding='utf-8') as f:
+        text = f.read()
+    for compiled, tibetan, _, _ in _resource('_SANSKRIT_PATTERNS'):
+        try:
+            expected = re.compile(tibetan)
+        except re.error:
+            expected = re.compile(re.escape(tibetan))
+        assert [m.span() for m in compiled.finditer(text)] == [m.span() for m in expected.finditer(text)]
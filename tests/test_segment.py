@@ -1,3 +1,5 @@
+import os
+import re
 import unittest
 from .test_helpers import assert_equal_phonetics
 
@@ -26,5 +28,78 @@ class TestSegmentation(unittest.TestCase):
           schema="kvp"
         )
 
+    def test_split_on_exceptions_matches_alternation_regex(self):
+        from phonetics import _segmentation_exceptions, _split_on_exceptions
+        keys = sorted(_segmentation_exceptions.keys(), key=len, reverse=True)
+        pattern = "(" + "|".join(map(re.escape, keys)) + ")"
+        for line in [
+          "སྣང་བ་མཐའ་ཡས་ཀྱི་ཞིང་",
+          "མཐའ་ཡས་མཐའ་ཡས་",
+          "རང་གཞན་གཉིས་ཀ་",
+          "ཇི་སྙེད་དོན་ཀུན་",
+          "",
+        ]:
+            self.assertEqual(_split_on_exceptions(line), re.split(pattern, line))
+
+    def test_single_pass_botok_matches_per_fragment(self):
+        import phonetics
+        with open(os.path.join(os.path.dirname(__file__), '..', 'benchmarks', 'corpus', 'exceptions.txt'), encoding='utf-8') as f:
+            text = f.read()
+        single_pass = phonetics.segmentbywords(text)
+        phonetics.SINGLE_PASS_BOTOK = False
+        try:
+            self.assertEqual(single_pass, phonetics.segmentbywords(text))
+        finally:
+            phonetics.SINGLE_PASS_BOTOK = True
+
+    def test_spans_within_cuts_line_tokens(self):
+        from phonetics import _spans_within, _join_tokens
+        line = "ཀ་ཁ་ ག་ང་"
+        tokens = [(0, 5), (5, 9)]
+        self.assertEqual(_spans_within(line, tokens, 0, 4), [(0, 4)])
+        self.assertEqual(_spans_within(line, tokens, 5, 9), [(5, 9)])
+        # A token running over the edge with more than a space or tsheg: tokenize the fragment alone
+        self.assertIsNone(_spans_within(line, tokens, 0, 2))
+        self.assertIsNone(_spans_within(line, tokens, 2, 9))
+        self.assertEqual(_join_tokens(line, [(0, 4), (5, 9)]), "ཀ་ཁ་ ག་ང་")
+
+    def test_single_pass_botok_falls_back_for_tokens_crossing_exceptions(self):
+        from unittest import mock
+        import phonetics
+        exceptions = { "མཐའ་ཡས་" : "མཐའ་ཡས་" }
+        line = "ཀ་ཁ་མཐའ་ཡས་ག་ང་"
+        calls = []
+        def syllables(in_str):
+            calls.append(in_str)
+            spans = [m.span() for m in re.finditer(r"[^་\s]+[་\s]*", in_str)]
+            if in_str == line:
+                # ཁ་མཐའ་ as one token, across the start of the exception
+                spans[1:3] = [(spans[1][0], spans[2][1])]
+            return spans
+        with mock.patch.object(phonetics, "_botok_spans", syllables):
+            single_pass = phonetics._segment_line_by_words(line, exceptions, False)
+            # Only the fragment the crossing token starts in is tokenized again
+            self.assertEqual(calls, [line, "ཀ་ཁ་"])
+            with mock.patch.object(phonetics, "SINGLE_PASS_BOTOK", False):
+                self.assertEqual(single_pass, phonetics._segment_line_by_words(line, exceptions, False))
+        self.assertEqual(single_pass, "ཀ་ ཁ་ མཐའ་ཡས་ ག་ ང་")
+
+    def test_iter_segmenters_match_full(self):
+        import phonetics
+        for text in ["", "ཇི་སྙེད་\n\nདོན་ཀུན་  \n\n", "ཀ\r\nཁ\rག\u2028ང", "ཇི་སྙེད་དོན་ཀུན་ཇི་བཞིན་གཟིགས་ཕྱིར་ཉིད་ཀྱི་ཐུགས་ཀར་གླེགས་བམ་འཛིན།།"]:
+            self.assertEqual("\n".join(phonetics.iter_segmentbywords(text)), phonetics.segmentbywords(text))
+            self.assertEqual("".join(line + "\n" for line in phonetics.iter_segmentbyone(text)), phonetics.segmentbyone(text))
+            self.assertEqual("".join(line + "\n" for line in phonetics.iter_segmentbytwo(text)), phonetics.segmentbytwo(text))
+
+    def test_segmentation_words_match_segmented_string(self):
+        import phonetics
+        for text in ["ཇི་སྙེད་ དོན་ཀུན་\n ཀ", " ཀ", "ཀ་ཁ་ ། ག\n\nང་", "abc ཀ་ཁ་ག"]:
+            for segment in (phonetics._segmentation_by_one, phonetics._segmentation_by_two):
+                segmentation = segment(text)
+                segmented = str(segmentation)
+                self.assertEqual(segmentation.line_words(), [line.split() for line in segmented.split("\n")])
+        self.assertEqual(phonetics.segmentbytwo(" ཀ་"), "ཀ་\n")
+        self.assertEqual(phonetics.segmentbytwo("ཀ་ཁ་ག་ང་ཅ་"), "ཀ་ཁ་ ག་ང་ཅ་\n")
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,200 @@
+import json
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from server import api
+from phonetics import convert
+
+@pytest.fixture
+def client():
+    return api.test_client()
+
+def test_batch_returns_results_in_order(client):
+    items = [
+        { "str": "ཇི་སྙེད་དོན་ཀུན་", "mode": "one" },
+        { "str": "ཨོཾ་ཨཱཿཧཱུྃ་", "sanskrit_mode": "iast" },
+        { "str": "ཇི་སྙེད་དོན་ཀུན་", "mode": "one" },
+        { "str": "ཇི་སྙེད་ དོན་ཀུན་", "mode": "none" },
+    ]
+    response = client.post('/batch', json={ "items": items })
+    assert response.status_code == 200
+    results = json.loads(response.data)["results"]
+    assert results[0] == results[2] == convert("ཇི་སྙེད་དོན་ཀུན་", "one")
+    assert results[1] == convert("ཨོཾ་ཨཱཿཧཱུྃ་", sanskrit_mode="iast")
+    assert "segmented" not in results[3]
+
+def test_batch_matches_single_routes(client):
+    text = "ཇི་སྙེད་དོན་ཀུན་ཇི་བཞིན་གཟིགས་ཕྱིར་"
+    single = json.loads(client.post('/segmentbytwo', data={ "str": text, "sanskrit_mode": "keep" }).data)
+    batch = json.loads(client.post('/batch', json={ "items": [{ "str": text, "mode": "two", "sanskrit_mode": "keep" }] }).data)
+    assert batch["results"] == [single]
+
+@pytest.mark.parametrize("body", [{}, { "items": [{ "mode": "one" }] }, { "items": [{ "str": "ཀ", "mode": "three" }] }])
+def test_batch_rejects_invalid_items(client, body):
+    response = client.post('/batch', json=body)
+    assert response.status_code == 400
+    assert "error" in json.loads(response.data)
+
+@pytest.mark.parametrize("option", [{ "mode": ["one"] }, { "sanskrit_mode": ["iast"] }, { "anusvara_style": { "ṃ": 1 } }, { "schemas": [["kvp"]] }])
+def test_batch_rejects_invalid_options_with_item_index(client, option):
+    response = client.post('/batch', json={ "items": [{ "str": "ཀ་" }, dict(option, str="ཁ་")] })
+    assert response.status_code == 400
+    assert json.loads(response.data)["error"].startswith("item 1:")
+
+def test_incremental_returns_line_results(client):
+    from incremental import line_hash, LINE_CACHE
+    LINE_CACHE.clear()
+    text = "ཇི་སྙེད་དོན་ཀུན་\nཨོཾ་ཨཱཿཧཱུྃ་"
+    lines = [{ "hash": line_hash(line), "str": line } for line in text.split("\n")]
+    response = client.post('/incremental', json={ "mode": "words", "sanskrit_mode": "iast", "lines": lines })
+    data = json.loads(response.data)
+    assert data["missing"] == []
+    full = convert(text, "words", sanskrit_mode="iast")
+    for key in ("segmented", "kvp", "ipa"):
+        assert "\n".join(data["results"][line["hash"]][key] for line in lines) == full[key].rstrip("\n")
+
+@pytest.mark.parametrize("body", [
+    { "sanskrit_mode": ["iast"] },
+    { "anusvara_style": 1 },
+    { "mode": { "words": 1 } },
+    { "lines": [{ "hash": ["0"], "str": "ཀ་" }] },
+])
+def test_incremental_rejects_invalid_options(client, body):
+    response = client.post('/incremental', json=dict({ "lines": [{ "str": "ཀ་" }] }, **body))
+    assert response.status_code == 400
+    assert "error" in json.loads(response.data)
+
+def test_incremental_reports_unknown_hashes(client):
+    from incremental import line_hash
+    known = "ཇི་སྙེད་"
+    client.post('/incremental', json={ "mode": "none", "lines": [{ "hash": line_hash(known), "str": known }] })
+    response = client.post('/incremental', json={ "mode": "none", "lines": [{ "hash": line_hash(known) }, { "hash": "0" * 40 }] })
+    data = json.loads(response.data)
+    assert list(data["results"]) == [line_hash(known)]
+    assert data["missing"] == ["0" * 40]
+
+def test_schemas_limit_outputs(client):
+    text = "ཇི་སྙེད་ དོན་ཀུན་"
+    kvp_only = json.loads(client.post('/phoneticize', data={ "str": text, "schemas": "kvp" }).data)
+    both = json.loads(client.post('/phoneticize', data={ "str": text }).data)
+    assert kvp_only == { "kvp": both["kvp"] }
+    batch = json.loads(client.post('/batch', json={ "items": [{ "str": text, "mode": "none", "schemas": ["ipa"] }] }).data)
+    assert batch["results"] == [{ "ipa": both["ipa"] }]
+
+def test_unknown_schema_is_rejected(client):
+    response = client.post('/segmentbywords', data={ "str": "ཀ་", "schemas": "kvp,xyz" })
+    assert response.status_code == 400
+
+def test_stream_routes_yield_one_object_per_line(client):
+    text = "ཇི་སྙེད་དོན་ཀུན་\nཇི་བཞིན་གཟིགས་ཕྱིར་"
+    for route, mode in (('/segmentbywords/stream', 'words'), ('/segmentbytwo/stream', 'two'), ('/phoneticize/stream', 'none')):
+        response = client.post(route, data={ "str": text, "schemas": "kvp" })
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+        full = convert(text, mode, schemas=["kvp"])
+        assert len(lines) == 2
+        for key in full:
+            assert "\n".join(line[key] for line in lines).rstrip("\n") == full[key].rstrip("\n")
+
+def test_input_limits_are_enforced(client, monkeypatch):
+    import limits
+    monkeypatch.setattr(limits, "MAX_LINE_CHARS", 10)
+    response = client.post('/segmentbyone', data={ "str": "ཇི་སྙེད་དོན་ཀུན་ཇི་བཞིན་གཟིགས་ཕྱིར་" })
+    assert response.status_code == 413
+    assert "line" in json.loads(response.data)["error"]
+    assert client.post('/segmentbyone', data={ "str": "ཇི་སྙེད་\nདོན་ཀུན་" }).status_code == 200
+    monkeypatch.setattr(limits, "MAX_WORDS", 3)
+    response = client.post('/batch', json={ "items": [{ "str": "ཇི་སྙེད་" }, { "str": "དོན་ཀུན་" }] })
+    assert response.status_code == 413
+
+def test_time_budget_stops_conversion(client, monkeypatch):
+    import limits
+    from server import RESPONSE_CACHE
+    RESPONSE_CACHE.clear()
+    monkeypatch.setattr(limits, "TIME_BUDGET", 1e-9)
+    response = client.post('/segmentbyone', data={ "str": "ཇི་སྙེད་དོན་ཀུན་" })
+    assert response.status_code == 413
+    assert "budget" in json.loads(response.data)["error"]
+    response = client.post('/segmentbyone/stream', data={ "str": "ཇི་སྙེད་\nདོན་ཀུན་" })
+    assert "budget" in json.loads(response.data.decode().splitlines()[-1])["error"]
+
+def test_responses_are_cached_with_etags(client):
+    from server import RESPONSE_CACHE
+    RESPONSE_CACHE.clear()
+    data = { "str": "བློ་གྲོས་མཐའ་ཡས་", "sanskrit_mode": "iast" }
+    first = client.post('/segmentbywords', data=data)
+    etag = first.headers["ETag"]
+    second = client.post('/segmentbywords', data=data)
+    assert second.data == first.data and second.headers["ETag"] == etag
+    assert RESPONSE_CACHE.stats()["hits"] == 1
+    # Other options, other key
+    assert client.post('/segmentbywords', data={ "str": data["str"] }).headers["ETag"] != etag
+    revalidated = client.post('/segmentbywords', data=data, headers={ "If-None-Match": etag })
+    assert revalidated.status_code == 304 and revalidated.data == b""
+    stored = client.get(first.headers["Content-Location"])
+    assert stored.status_code == 200 and stored.data == first.data
+    assert "immutable" in stored.headers["Cache-Control"]
+    assert client.get('/result/' + "0" * 64).status_code == 404
+
+def test_response_cache_skips_long_bodies(client, monkeypatch):
+    import server
+    server.RESPONSE_CACHE.clear()
+    monkeypatch.setattr(server, "RESPONSE_CACHE_MAX_CHARS", 10)
+    response = client.post('/segmentbywords', data={ "str": "བློ་གྲོས་མཐའ་ཡས་" })
+    assert response.status_code == 200 and "Content-Location" not in response.headers
+    assert len(server.RESPONSE_CACHE) == 0
+
+@pytest.fixture
+def built_assets(tmp_path, monkeypatch):
+    import assets
+    import server
+    monkeypatch.setattr(assets, "ASSETS_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "ASSETS", assets.build(assets.WEB_DIR, str(tmp_path)))
+    return server.ASSETS
+
+def test_index_refers_to_hashed_immutable_assets(client, built_assets):
+    import gzip
+    ASSETS = built_assets
+    index = client.get('/')
+    assert "no-cache" in index.headers["Cache-Control"]
+    html = index.data.decode("utf-8")
+    assert "/assets/" + ASSETS["app.js"] in html and '"app.js"' not in html
+    font = client.get('/assets/' + ASSETS["fonts/DDCUchenRegular.ttf"], headers={ "Accept-Encoding": "gzip" })
+    assert font.status_code == 200
+    assert "immutable" in font.headers["Cache-Control"]
+    assert font.headers["Content-Encoding"] == "gzip"
+    with open(os.path.join(os.path.dirname(__file__), '..', 'web', 'fonts', 'DDCUchenRegular.ttf'), 'rb') as f:
+        assert gzip.decompress(font.data) == f.read()
+    assert client.get('/assets/' + ASSETS["logo.png"], headers={ "Accept-Encoding": "gzip" }).headers.get("Content-Encoding") is None
+
+def test_asset_builds_prune_old_files(tmp_path):
+    import assets
+    web = tmp_path / "web"
+    out = str(tmp_path / "assets")
+    web.mkdir()
+    for version in ("1", "2", "3"):
+        (web / "app.js").write_text(f"var version = {version};")
+        (web / "index.html").write_text('<script src="app.js"></script>')
+        manifest = assets.build(str(web), out)
+        if version == "1":
+            first = manifest["app.js"]
+    # The previous build's files are kept for servers not restarted yet, older ones deleted
+    files = set(os.listdir(out))
+    assert manifest["app.js"] in files and assets.hashed_name("app.js", b"var version = 2;") in files
+    assert first not in files and first + ".gz" not in files
+    assert assets.load(str(web), out) == manifest
+    (web / "app.js").write_text("var version = 40;")
+    assert assets.load(str(web), out) == {}
+
+def test_large_json_responses_are_compressed(client):
+    import gzip
+    text = "ཇི་སྙེད་དོན་ཀུན་ཇི་བཞིན་གཟིགས་ཕྱིར་\n" * 50
+    plain = client.post('/segmentbyone', data={ "str": text })
+    compressed = client.post('/segmentbyone', data={ "str": text }, headers={ "Accept-Encoding": "gzip" })
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(compressed.data) == plain.data
+    assert compressed.headers["ETag"] == "W/" + plain.headers["ETag"]
+    assert client.post('/segmentbyone', data={ "str": text }, headers={ "If-None-Match": compressed.headers["ETag"] }).status_code == 304
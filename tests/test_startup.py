@@ -0,0 +1,30 @@
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import phonetics
+
+def test_warm_up_reports_stages():
+    startup_times = phonetics.warm_up()
+    for stage in ('tokenizer', 'kvp_converter', 'ipa_converter', 'sanskrit_index'):
+        assert stage in startup_times
+
+def test_precompiled_tables_are_reused(tmp_path, monkeypatch):
+    monkeypatch.setattr(phonetics, 'CACHE_DIR', str(tmp_path))
+    tables = phonetics._load_precompiled()
+    assert (tmp_path / 'precompiled.pickle').exists()
+
+    def fail():
+        raise AssertionError("tables should have been loaded from disk")
+    monkeypatch.setattr(phonetics, '_build_precompiled', fail)
+    assert phonetics._load_precompiled() == tables
+
+def test_precompiled_tables_rebuilt_when_sources_change(tmp_path, monkeypatch):
+    monkeypatch.setattr(phonetics, 'CACHE_DIR', str(tmp_path))
+    phonetics._load_precompiled()
+    monkeypatch.setattr(phonetics, '_precompiled_source_hash', lambda: 'changed')
+    built = []
+    build = phonetics._build_precompiled
+    monkeypatch.setattr(phonetics, '_build_precompiled', lambda: built.append(1) or build())
+    phonetics._load_precompiled()
+    assert built == [1]
@@ -32,6 +32,126 @@ window.alpineData = function () {
     `);
   const storedText = load(STORAGE_KEYS.originalText, defaultText);
 
+  // Line results from /incremental, keyed by options and line hash
+  const lineResults = new Map();
+  const MAX_LINE_RESULTS = 5000;
+
+  // Live-editing session on the /session WebSocket (served by asgi.py): each
+  // edit carries a sequence number and the server drops or stops the
+  // conversion of an edit as soon as a later one arrives.
+  const SUPERSEDED = {};
+  let liveUnavailable = !window.WebSocket;
+
+  function liveSession() {
+    let socket = null;
+    let seq = 0;
+    const pending = new Map();
+
+    function connect() {
+      const url =
+        (location.protocol === "https:" ? "wss://" : "ws://") +
+        location.host +
+        "/session";
+      const ws = new WebSocket(url);
+      let opened = false;
+      ws.onopen = () => (opened = true);
+      ws.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        const resolve = pending.get(data.seq);
+        if (!resolve) return;
+        pending.delete(data.seq);
+        resolve(data.superseded ? SUPERSEDED : data.error ? null : data);
+      };
+      ws.onclose = () => {
+        // Never opened: not served by this server (Flask, prefork)
+        if (!opened) liveUnavailable = true;
+        socket = null;
+        for (const resolve of pending.values()) resolve(null);
+        pending.clear();
+      };
+      return ws;
+    }
+
+    // Returns the same fields as convertByLines, SUPERSEDED when a later call
+    // was made before the result came, or null to fall back to HTTP.
+    return async function convert(text, mode, sanskritMode, anusvaraStyle, schema) {
+      if (liveUnavailable) return null;
+      socket = socket || connect();
+      const ws = socket;
+      if (ws.readyState === WebSocket.CONNECTING) {
+        await new Promise((resolve) => {
+          ws.addEventListener("open", resolve, { once: true });
+          ws.addEventListener("close", resolve, { once: true });
+        });
+      }
+      if (ws.readyState !== WebSocket.OPEN) return null;
+      const current = ++seq;
+      return new Promise((resolve) => {
+        pending.set(current, resolve);
+        ws.send(
+          JSON.stringify({
+            seq: current,
+            str: text,
+            mode: mode,
+            sanskrit_mode: sanskritMode,
+            anusvara_style: anusvaraStyle,
+            schemas: [schema],
+          })
+        );
+      });
+    };
+  }
+
+  // One session per editing step, so they don't supersede each other
+  const segmentLive = liveSession();
+  const phoneticizeLive = liveSession();
+
+  // Convert text line by line, only sending the lines without a cached result.
+  // Returns the same fields as the full routes, or null if the caller should
+  // fall back to them (no crypto.subtle outside https/localhost, server error).
+  async function convertByLines(text, mode, sanskritMode, anusvaraStyle, schema) {
+    if (!(window.crypto && crypto.subtle)) return null;
+    const lines = text.split("\n");
+    const hashes = await Promise.all(lines.map(sha1Hex));
+    const prefix = `${mode}|${sanskritMode}|${anusvaraStyle}|${schema}|`;
+    const changed = new Map();
+    lines.forEach((line, i) => {
+      if (!lineResults.has(prefix + hashes[i])) {
+        changed.set(hashes[i], line);
+      }
+    });
+    if (changed.size) {
+      const response = await fetch("/incremental", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({
+          mode: mode,
+          sanskrit_mode: sanskritMode,
+          anusvara_style: anusvaraStyle,
+          schemas: [schema],
+          lines: Array.from(changed, ([hash, str]) => ({ hash, str })),
+        }),
+      });
+      if (!response.ok) return null;
+      const data = await response.json();
+      for (const [hash, res] of Object.entries(data.results)) {
+        lineResults.set(prefix + hash, res);
+      }
+      while (lineResults.size > MAX_LINE_RESULTS) {
+        lineResults.delete(lineResults.keys().next().value);
+      }
+    }
+    const results = hashes.map((hash) => lineResults.get(prefix + hash));
+    if (results.some((res) => !res)) return null;
+    const data = {
+      [schema]: results.map((res) => res[schema] + "\n").join(""),
+    };
+    if (mode !== "none") {
+      data.segmented = results.map((res) => res.segmented).join("\n");
+    }
+    return data;
+  }
+
   return {
     step: 1,
     originalText: storedText === "" ? defaultText : storedText,
@@ -62,11 +182,23 @@ window.alpineData = function () {
       return this.windowWidth < 1024;
     },
 
+    // Only the schema on display is requested: KVP, or IPA which the other
+    // phoneticization styles are derived from
+    get requestedSchema() {
+      return this.phoneticization === "kvp" ? "kvp" : "ipa";
+    },
+
     async segment() {
       const formData = new FormData();
       formData.append("str", this.originalText);
       formData.append("sanskrit_mode", this.sanskritMode);
       formData.append("anusvara_style", this.anusvaraStyle);
+      // Word and two-syllable segmentation switch the display to KVP below
+      const schema =
+        this.segmentationType === "words" || this.segmentationType === "two"
+          ? "kvp"
+          : this.requestedSchema;
+      formData.append("schemas", schema);
 
       const endpoint =
         this.segmentationType === "words"
@@ -76,11 +208,35 @@ window.alpineData = function () {
           : "/segmentbyone";
 
       try {
-        const response = await fetch(endpoint, {
-          method: "POST",
-          body: formData,
-        });
-        const data = await response.json();
+        // Word segmentation is done line by line, so only changed lines are sent
+        let data =
+          this.segmentationType === "words"
+            ? await segmentLive(
+                this.originalText,
+                "words",
+                this.sanskritMode,
+                this.anusvaraStyle,
+                schema
+              )
+            : null;
+        // A later edit is being converted
+        if (data === SUPERSEDED) return;
+        if (!data && this.segmentationType === "words") {
+          data = await convertByLines(
+            this.originalText,
+            "words",
+            this.sanskritMode,
+            this.anusvaraStyle,
+            schema
+          );
+        }
+        if (!data) {
+          const response = await fetch(endpoint, {
+            method: "POST",
+            body: formData,
+          });
+          data = await response.json();
+        }
 
         // Count trailing newlines in original text
         const originalTrailingCount = (
@@ -89,8 +245,8 @@ window.alpineData = function () {
 
         // Process segmented text and preserve trailing newlines
         let segmentedText = data.segmented.replace(/^ +/gm, "");
-        let kvpText = data.kvp;
-        let ipaText = data.ipa;
+        let kvpText = data.kvp || "";
+        let ipaText = data.ipa || "";
 
         // Count current trailing newlines and adjust if needed
         const currentTrailingCount = (segmentedText.match(/(\r?\n)*$/)[0] || "")
@@ -304,21 +460,44 @@ window.alpineData = function () {
       formData.append("str", this.segmentedText);
       formData.append("sanskrit_mode", this.sanskritMode);
       formData.append("anusvara_style", this.anusvaraStyle);
+      const schema = this.requestedSchema;
+      formData.append("schemas", schema);
 
       try {
-        const response = await fetch("/phoneticize", {
-          method: "POST",
-          body: formData,
-        });
-        const data = await response.json();
+        let data = await phoneticizeLive(
+          this.segmentedText,
+          "none",
+          this.sanskritMode,
+          this.anusvaraStyle,
+          schema
+        );
+        if (data === SUPERSEDED) return;
+        if (!data) {
+          data = await convertByLines(
+            this.segmentedText,
+            "none",
+            this.sanskritMode,
+            this.anusvaraStyle,
+            schema
+          );
+        }
+        if (!data) {
+          const response = await fetch("/phoneticize", {
+            method: "POST",
+            body: formData,
+          });
+          data = await response.json();
+        }
 
         // Transform and store results
+        const kvpText = data.kvp || "";
+        const ipaText = data.ipa || "";
         this.phoneticResult = {
-          kvp: kvptodisplay(data.kvp),
-          ipa: ipatodisplay(data.ipa),
-          advanced: ipatophon(data.ipa, "advanced"),
-          intermediate: ipatophon(data.ipa, "intermediate"),
-          simple: ipatophon(data.ipa, "simple"),
+          kvp: kvptodisplay(kvpText),
+          ipa: ipatodisplay(ipaText),
+          advanced: ipatophon(ipaText, "advanced"),
+          intermediate: ipatophon(ipaText, "intermediate"),
+          simple: ipatophon(ipaText, "simple"),
         };
       } catch (error) {
         console.error("Error:", error);
@@ -498,6 +677,16 @@ const stripIndent = (str) =>
     .map((line) => line.trim())
     .join("\n");
 
+async function sha1Hex(text) {
+  const digest = await crypto.subtle.digest(
+    "SHA-1",
+    new TextEncoder().encode(text)
+  );
+  return Array.from(new Uint8Array(digest), (b) =>
+    b.toString(16).padStart(2, "0")
+  ).join("");
+}
+
 function ipatophon(ipa, level) {
   res = ipa.replace(/(?:\r\n|\r|\n)/g, "<br/>");
   res = res.replace(/y/g, "ü");